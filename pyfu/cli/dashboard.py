@@ -1,21 +1,36 @@
-import sys
+import argparse
 import os
 from sys import exit
-import yaml
 
-from pyfu.ui import ui
+from pyfu.ui import ui, config, collector, recorder
+
+parser = argparse.ArgumentParser(description='Live terminal dashboards of shell command output.')
+parser.add_argument('names', nargs='*', metavar='name',
+                    help='the dashboard to show; with several, tab and 1-9 switch between them')
+parser.add_argument('--serve', action='store_true',
+                    help='run the dashboard\'s commands without a terminal and publish the output to every '
+                         '`dashboard <name>` on this host')
+parser.add_argument('--replay', metavar='NAME',
+                    help='play back what a dashboard with record-dir set showed, without running any commands')
+parser.add_argument('--from', dest='start', default='10m',
+                    help='where --replay starts: 20m (ago), 14:05, or 2024-05-01 14:05:00 (default 10m)')
+parser.add_argument('--speed', type=float, default=1.0, help='--replay speed, 2 plays twice as fast')
+args = parser.parse_args()
 
 yaml_path = os.path.expanduser("~") + '/.dashboard/dashboard.yaml'
 if not os.path.isfile(yaml_path):
     print("No yaml file: " + yaml_path)
     exit(1)
-yaml_contents = '\n'.join([line.rstrip('\n') for line in open(yaml_path)])
-if not yaml_contents:
-    print("Your yaml file is empty: " + yaml_path)
+try:
+    properties = config.load(yaml_path)
+except config.ConfigError as e:
+    print(e)
     exit(1)
-properties = yaml.load(yaml_contents)
 
-if len(sys.argv) == 1:
+if args.replay:
+    args.names = [args.replay]
+
+if not args.names:
     dashboards = []
     if properties:
         dashboards = [d['name'] for d in properties['dashboards']]
@@ -23,7 +38,36 @@ if len(sys.argv) == 1:
     print("Which dashboard? " + str(dashboards))
     exit(1)
 
-name = sys.argv[1]
+if len(args.names) > 1 and args.serve:
+    print("--serve runs one dashboard at a time")
+    exit(1)
+
+name = args.names[0]
 d = [d for d in properties['dashboards'] if d['name'] == name][0]
-dashboard = ui.Dashboard(d, name)
-dashboard.run()
+if args.serve:
+    try:
+        collector.serve(ui.Dashboard(d, name, yaml_path, use_collector=False))
+    except RuntimeError as e:
+        print(e)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(0)
+elif args.replay:
+    if not d.get('record-dir'):
+        print("Dashboard '{}' isn't recorded, set its record-dir".format(name))
+        exit(1)
+    try:
+        start = recorder.parse_time(args.start)
+        reader = recorder.Reader(os.path.expanduser(d['record-dir']), name)
+    except ValueError as e:
+        print(e)
+        exit(1)
+    dashboard = ui.Dashboard(d, name, use_collector=False)
+    dashboard.scheduler = recorder.ReplayScheduler(dashboard, reader, start, args.speed)
+    dashboard.run()
+elif len(args.names) > 1:
+    ui.run_tabs([ui.Dashboard([d for d in properties['dashboards'] if d['name'] == n][0], n, yaml_path)
+                 for n in args.names])
+else:
+    dashboard = ui.Dashboard(d, name, yaml_path)
+    dashboard.run()
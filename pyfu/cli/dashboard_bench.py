@@ -0,0 +1,108 @@
+"""
+Renders synthetic dashboards on a headless termbox and reports what it cost.
+
+Examples:
+    python -m pyfu.cli.dashboard_bench --boxes 12 --lines 20 --rates 1,2,5
+    python -m pyfu.cli.dashboard_bench --boxes 12 --mode raw
+"""
+
+import argparse
+import datetime
+import random
+import string
+import time
+
+from pyfu.ui import ui
+from pyfu.ui.headless import HeadlessTermbox
+from pyfu.ui.screen import Screen
+
+__author__ = 'Dan Barrese'
+__pythonver__ = '3.5'
+
+parser = argparse.ArgumentParser(description='Benchmark dashboard rendering without a terminal.')
+parser.add_argument('--boxes', type=int, default=12, help='number of boxes')
+parser.add_argument('--lines', type=int, default=20, help='lines of output per box')
+parser.add_argument('--columns', type=int, default=2, help='boxes per row')
+parser.add_argument('--width', type=int, default=200, help='screen width')
+parser.add_argument('--height', type=int, default=60, help='screen height')
+parser.add_argument('--rates', default='1,2,5', help='comma separated refresh rates in seconds, assigned round robin')
+parser.add_argument('--seconds', type=int, default=60, help='simulated seconds to run')
+parser.add_argument('--fps', type=float, default=30, help='frames per simulated second')
+parser.add_argument('--change', type=float, default=0.2, help='fraction of lines that change on each refresh')
+parser.add_argument('--mode', choices=['diff', 'raw'], default='diff',
+                    help='diff: back-buffered render loop.  raw: every refresh clears and repaints the whole screen.')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+
+def random_line(width):
+    return ''.join(random.choice(string.ascii_letters + string.digits + ' ') for _ in range(width))
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+headless = HeadlessTermbox(args.width, args.height)
+termbox = Screen(headless) if args.mode == 'diff' else headless
+dashboard = ui.Dashboard({'width': args.width, 'height': args.height, 'fps': args.fps, 'boxes': []}, 'bench')
+
+rates = [float(rate) for rate in args.rates.split(',')]
+box_width = int(args.width / args.columns) - 1
+box_height = max(3, int(args.height / max(1, args.boxes / args.columns)))
+contents = {}
+next_due = {}
+for i in range(args.boxes):
+    box = dashboard.add_box(termbox, box_width, box_height)
+    box.id = 'bench{}'.format(i)
+    box.header = box.id
+    box.refresh_rate = rates[i % len(rates)]
+    contents[box] = [random_line(box_width - 2) for _ in range(args.lines)]
+    next_due[box] = 0.0
+
+frame_times = []
+refreshes = 0
+frames = int(args.seconds * args.fps)
+cpu_started = time.process_time()
+wall_started = time.perf_counter()
+for frame in range(frames):
+    now = frame / args.fps
+    started = time.perf_counter()
+    for box in dashboard.boxes:
+        if now < next_due[box]:
+            continue
+        lines = contents[box]
+        for _ in range(int(len(lines) * args.change)):
+            lines[random.randrange(len(lines))] = random_line(box_width - 2)
+        box.show('\n'.join(lines), datetime.datetime.now())
+        if args.mode == 'raw':
+            # the old behavior: each refresh redraws every box on a cleared screen.
+            dashboard.redraw(termbox)
+        next_due[box] = now + box.refresh_rate
+        refreshes += 1
+    if args.mode == 'diff':
+        dirty, status, full = dashboard.take_dirty()
+        if dirty or status or full:
+            dashboard.render(termbox, dirty, full, status)
+    frame_times.append(time.perf_counter() - started)
+cpu = time.process_time() - cpu_started
+wall = time.perf_counter() - wall_started
+
+print('mode:                 {}'.format(args.mode))
+print('boxes x lines:        {} x {}'.format(args.boxes, args.lines))
+print('simulated seconds:    {}'.format(args.seconds))
+print('refreshes:            {}'.format(refreshes))
+print('frames presented:     {}'.format(headless.present_calls))
+print('change_cell calls:    {} ({} per refresh)'.format(
+    headless.change_cell_calls, round(headless.change_cell_calls / max(1, refreshes), 1)))
+print('frame time ms p50:    {}'.format(round(percentile(frame_times, 50) * 1000, 3)))
+print('frame time ms p90:    {}'.format(round(percentile(frame_times, 90) * 1000, 3)))
+print('frame time ms p99:    {}'.format(round(percentile(frame_times, 99) * 1000, 3)))
+print('frame time ms max:    {}'.format(round(max(frame_times) * 1000, 3)))
+print('cpu sec per second:   {}'.format(round(cpu / args.seconds, 4)))
+print('wall sec total:       {}'.format(round(wall, 2)))
@@ -0,0 +1,99 @@
+"""
+Turns ANSI escape sequences in command output into termbox colors.
+"""
+
+import re
+
+# termbox attribute bits, or'd into the foreground color
+BOLD = 0x0100
+UNDERLINE = 0x0200
+REVERSE = 0x0400
+
+# SGR (colors and attributes), other CSI sequences, OSC strings, charset selection, anything else after ESC
+ESCAPE = re.compile(r'\x1b(?:\[([0-9;:?]*)[ -/]*([@-~])|\][^\x07\x1b]*(?:\x07|\x1b\\)?|[()*+][0-9A-Za-z]|.?)')
+
+
+def _color(n):
+    # 0 means "default" to termbox, so black is drawn with the 256-color palette's black.
+    return 16 if n == 0 else n
+
+
+def rgb_to_256(r, g, b):
+    """The nearest color in the xterm 6x6x6 color cube."""
+    return 16 + 36 * round(r / 255.0 * 5) + 6 * round(g / 255.0 * 5) + round(b / 255.0 * 5)
+
+
+def _extended(codes, i):
+    """Reads a 38/48 color at codes[i:], returns (color or None, index after it)."""
+    if i < len(codes) and codes[i] == 5 and i + 1 < len(codes):
+        return _color(codes[i + 1]), i + 2
+    if i < len(codes) and codes[i] == 2 and i + 3 < len(codes):
+        return rgb_to_256(*codes[i + 1:i + 4]), i + 4
+    return None, len(codes)
+
+
+def apply_sgr(params, state, default_fg, default_bg):
+    """Returns the (fg, bg, attributes) after an SGR sequence such as '1;31' or '38;5;208'."""
+    fg, bg, attrs = state
+    codes = [int(code) if code.isdigit() else 0 for code in re.split('[;:]', params)]
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        i += 1
+        if code == 0:
+            fg, bg, attrs = default_fg, default_bg, 0
+        elif code == 1:
+            attrs |= BOLD
+        elif code == 4:
+            attrs |= UNDERLINE
+        elif code == 7:
+            attrs |= REVERSE
+        elif code == 22:
+            attrs &= ~BOLD
+        elif code == 24:
+            attrs &= ~UNDERLINE
+        elif code == 27:
+            attrs &= ~REVERSE
+        elif 30 <= code <= 37:
+            fg = _color(code - 30)
+        elif 90 <= code <= 97:
+            fg = code - 90 + 8
+        elif code == 39:
+            fg = default_fg
+        elif 40 <= code <= 47:
+            bg = _color(code - 40)
+        elif 100 <= code <= 107:
+            bg = code - 100 + 8
+        elif code == 49:
+            bg = default_bg
+        elif code in (38, 48):
+            color, i = _extended(codes, i)
+            if color is not None and code == 38:
+                fg = color
+            elif color is not None:
+                bg = color
+    return fg, bg, attrs
+
+
+def parse(line, fg, bg):
+    """
+    Splits a line into (text, fg, bg) runs, with the escape sequences removed.
+
+    Colors and attributes set by SGR sequences apply until the end of the
+    line; every line starts from the box's own fg and bg.  Escape sequences
+    that aren't SGR are dropped.
+    """
+    if '\x1b' not in line:
+        return [(line, fg, bg)]
+    runs = []
+    state = (fg, bg, 0)
+    pos = 0
+    for match in ESCAPE.finditer(line):
+        if match.start() > pos:
+            runs.append((line[pos:match.start()], state[0] | state[2], state[1]))
+        pos = match.end()
+        if match.group(2) == 'm':
+            state = apply_sgr(match.group(1), state, fg, bg)
+    if pos < len(line):
+        runs.append((line[pos:], state[0] | state[2], state[1]))
+    return runs
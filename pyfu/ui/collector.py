@@ -0,0 +1,235 @@
+"""
+Runs a dashboard's commands once for everyone watching it.
+
+`dashboard --serve <name>` runs the boxes of one dashboard without a
+terminal and publishes every result on a Unix socket.  `dashboard <name>`
+connects to that socket when a collector is running, and then only renders
+what it receives.  Messages are JSON, one per line.
+
+The socket is in a directory anyone on the host can write to, so the first
+message a collector sends is a hash of its box definitions.  A dashboard
+only uses a collector whose hash matches its own config.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import socket
+import threading
+
+from pyfu.ui.headless import HeadlessTermbox
+from pyfu.ui.resultcache import DEFAULT_DIR
+from pyfu.ui.screen import Screen
+
+# seconds a dashboard waits for a collector's handshake before running its boxes itself
+HANDSHAKE_SEC = 2
+
+
+def socket_path(properties, name):
+    return properties.get('socket') or os.path.join(properties.get('cache-dir', DEFAULT_DIR), name + '.sock')
+
+
+def config_digest(properties):
+    """A hash of a dashboard's box definitions.  A collector and its clients have to agree on it."""
+    boxes = json.dumps(properties.get('boxes', []), sort_keys=True, default=str)
+    return hashlib.sha1(boxes.encode('utf8')).hexdigest()
+
+
+def connect(path, digest=None):
+    """
+    Returns a socket connected to the collector at path, or None if none is running.
+
+    With digest, also None unless the collector's handshake carries the same
+    config_digest, so a collector for someone else's dashboard of the same
+    name is never used.
+    """
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        if digest is not None:
+            sock.settimeout(HANDSHAKE_SEC)
+            if json.loads(_read_line(sock).decode('utf8')).get('config') != digest:
+                sock.close()
+                return None
+            sock.settimeout(None)
+    except (OSError, ValueError, AttributeError):
+        # a socket file left behind by a collector that died, or something that isn't a collector
+        sock.close()
+        return None
+    return sock
+
+
+def _read_line(sock):
+    # a byte at a time, so nothing after the handshake is left in a buffer.
+    line = b''
+    while not line.endswith(b'\n'):
+        byte = sock.recv(1)
+        if not byte or len(line) > 4096:
+            raise ValueError('no handshake')
+        line += byte
+    return line
+
+
+def encode(message):
+    return (json.dumps(message) + '\n').encode('utf8')
+
+
+def messages(sock):
+    """Yields the messages read from sock until it closes."""
+    with sock.makefile('rb') as stream:
+        for line in stream:
+            yield json.loads(line.decode('utf8'))
+
+
+class RemoteScheduler(object):
+    """
+    Takes the place of a local scheduler when a collector runs the boxes.
+
+    Output and status lines published by the collector are written into
+    the boxes with the same id.  r/R ask the collector to refresh.
+    """
+
+    def __init__(self, dashboard, sock):
+        self.dashboard = dashboard
+        self.sock = sock
+
+    def start(self):
+        thread = threading.Thread(target=self._receive, daemon=True)
+        thread.start()
+
+    def add(self, box):
+        # the collector reloads the same config and publishes the new box itself.
+        pass
+
+    def refresh_now(self, box):
+        try:
+            self.sock.sendall(encode({'refresh': box.id}))
+        except OSError:
+            pass
+
+    def queue_depth(self):
+        return 0
+
+    def _receive(self):
+        try:
+            for message in messages(self.sock):
+                self._show(message)
+        except (OSError, ValueError):
+            pass
+        self.sock.close()
+        self.dashboard.collector_lost()
+
+    def _show(self, message):
+        for box in self.dashboard.boxes:
+            if box.id != message['id']:
+                continue
+            if 'contents' in message:
+                # already filtered by the collector
+                box.contents = message['contents']
+            box.status = message['status']
+            self.dashboard.mark_dirty(box, status_only='contents' not in message)
+
+
+class Client(object):
+    """A connected dashboard.  Messages queue up per client, so a slow terminal can't hold up the others."""
+
+    # a client this many messages behind is disconnected
+    BACKLOG = 1000
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.queue = queue.Queue(Client.BACKLOG)
+
+    def send_forever(self):
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                self.sock.sendall(data)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class Collector(object):
+    """Publishes every box result of a dashboard to the clients connected to its socket."""
+
+    def __init__(self, dashboard, path):
+        self.dashboard = dashboard
+        self.path = path
+        self.lock = threading.Lock()
+        self.clients = []
+
+    def publish(self, box, status_only=False):
+        message = {'id': box.id, 'status': box.status}
+        if not status_only:
+            message['contents'] = box.contents
+        data = encode(message)
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.queue.put_nowait(data)
+                except queue.Full:
+                    self.clients.remove(client)
+                    client.close()
+
+    def serve_forever(self):
+        if connect(self.path):
+            raise RuntimeError('a collector is already running on ' + self.path)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        # like the result cache, anyone on the host may watch.
+        os.chmod(self.path, 0o666)
+        server.listen()
+        while True:
+            sock, _ = server.accept()
+            self._attach(Client(sock))
+
+    def _attach(self, client):
+        with self.lock:
+            client.queue.put_nowait(encode({'config': config_digest(self.dashboard.properties)}))
+            # the latest output of every box goes first, so a new client is up to date at once.
+            for box in self.dashboard.boxes:
+                client.queue.put_nowait(encode({'id': box.id, 'status': box.status, 'contents': box.contents}))
+            self.clients.append(client)
+        threading.Thread(target=client.send_forever, daemon=True).start()
+        threading.Thread(target=self._receive, args=(client,), daemon=True).start()
+
+    def _receive(self, client):
+        try:
+            for message in messages(client.sock):
+                for box in self.dashboard.boxes:
+                    if message.get('refresh') == box.id:
+                        self.dashboard.scheduler.refresh_now(box)
+        except (OSError, ValueError):
+            pass
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        try:
+            client.queue.put_nowait(None)
+        except queue.Full:
+            client.close()
+
+
+def serve(dashboard):
+    """Runs the dashboard's boxes without a terminal and publishes their output until killed."""
+    collector = Collector(dashboard, socket_path(dashboard.properties, dashboard.name))
+    dashboard.listeners.append(collector.publish)
+    dashboard.start(Screen(HeadlessTermbox(dashboard.max_col, dashboard.max_row)))
+    collector.serve_forever()
@@ -0,0 +1,282 @@
+"""
+Loads, validates and watches ~/.dashboard/dashboard.yaml, with a binary cache for fast startup.
+"""
+
+import numbers
+import os
+import pickle
+import threading
+import time
+
+import yaml
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from pyfu.ui import sources
+from pyfu.ui.filters import compile_filter
+
+try:
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader
+
+# bump when the schema or the cached format changes, so old caches are ignored.
+CACHE_VERSION = 2
+
+
+class ConfigError(Exception):
+    pass
+
+
+def _number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _size(value):
+    return _integer(value) or value == 'auto'
+
+
+def _string(value):
+    return isinstance(value, str)
+
+
+def _color(value):
+    return _string(value) or _integer(value)
+
+
+def _flag(value):
+    return isinstance(value, bool)
+
+
+def _mapping(value):
+    return isinstance(value, dict)
+
+
+def _scheduler(value):
+    return value in ('threads', 'asyncio')
+
+
+def _source(value):
+    if not _string(value):
+        return False
+    # an unknown source would otherwise only fail once the dashboard is on screen.
+    sources.resolve(value)
+    return True
+
+
+def _filter(value):
+    if not _string(value):
+        return False
+    compile_filter(value)
+    return True
+
+
+DASHBOARD_KEYS = {
+    'name': (_string, 'a string'),
+    'width': (_size, 'a number of columns or auto'),
+    'height': (_size, 'a number of rows or auto'),
+    'boxes': (lambda v: isinstance(v, list), 'a list of boxes'),
+    'fps': (_number, 'a number'),
+    'scheduler': (_scheduler, 'threads or asyncio'),
+    'max-concurrency': (_integer, 'a whole number'),
+    'cache-dir': (_string, 'a path'),
+    'metrics-file': (_string, 'a path'),
+    'shell-pool': (_integer, 'a whole number'),
+    'socket': (_string, 'a path'),
+    'record-dir': (_string, 'a directory'),
+}
+
+BOX_KEYS = {
+    'id': (lambda v: _string(v) or _integer(v), 'a string or number'),
+    'name': (_string, 'a string'),
+    'cmd': (_string, 'a shell command'),
+    'source': (_source, 'python:module.func or a source name'),
+    'source-args': (_mapping, 'a mapping of keyword arguments'),
+    'width': (_integer, 'a number of columns'),
+    'height': (_integer, 'a number of rows'),
+    'rate-sec': (_number, 'a number of seconds'),
+    'min-rate-sec': (_number, 'a number of seconds'),
+    'max-rate-sec': (_number, 'a number of seconds'),
+    'timeout-sec': (_number, 'a number of seconds'),
+    'filter': (_filter, 'a grep/head/tail/cut/sort/uniq pipeline'),
+    'max-lines': (_integer, 'a whole number'),
+    'stream': (_flag, 'true or false'),
+    'stream-lines': (_integer, 'a whole number'),
+    'type': (lambda v: v in ('text', 'series'), 'text or series'),
+    'samples': (_integer, 'a whole number'),
+    'series-names': (lambda v: isinstance(v, list) and all(_string(n) for n in v), 'a list of names'),
+    'color-border-fg': (_color, 'a color name or number'),
+    'color-border-bg': (_color, 'a color name or number'),
+    'color-content-fg': (_color, 'a color name or number'),
+    'color-content-bg': (_color, 'a color name or number'),
+}
+
+
+def _check_keys(where, props, schema, errors):
+    for key, value in props.items():
+        if key not in schema:
+            errors.append("{}: unknown option '{}'".format(where, key))
+            continue
+        check, expected = schema[key]
+        try:
+            ok = check(value)
+        except Exception as e:
+            # checks compile filters and import sources, which can fail in more ways than ValueError
+            errors.append("{}: bad {}: {}".format(where, key, e))
+            continue
+        if not ok:
+            errors.append("{}: {} should be {}, not {!r}".format(where, key, expected, value))
+
+
+def validate(properties):
+    """Returns a list of every problem in the config, empty if there are none."""
+    if not _mapping(properties) or not isinstance(properties.get('dashboards'), list):
+        return ["the file should have a 'dashboards' list at the top"]
+    errors = []
+    for i, dashboard in enumerate(properties['dashboards']):
+        if not _mapping(dashboard):
+            errors.append("dashboard #{}: should be a mapping".format(i + 1))
+            continue
+        where = "dashboard '{}'".format(dashboard.get('name', '#{}'.format(i + 1)))
+        for key in ('name', 'width', 'height', 'boxes'):
+            if key not in dashboard:
+                errors.append("{}: missing {}".format(where, key))
+        _check_keys(where, dashboard, DASHBOARD_KEYS, errors)
+        auto = str(dashboard.get('height')) == 'auto'
+        boxes = dashboard.get('boxes')
+        if not isinstance(boxes, list):
+            continue
+        ids = set()
+        for j, box in enumerate(boxes):
+            if not _mapping(box):
+                errors.append("{} box #{}: should be a mapping".format(where, j + 1))
+                continue
+            box_where = "{} box '{}'".format(where, box.get('id', '#{}'.format(j + 1)))
+            if 'id' not in box:
+                errors.append("{}: missing id".format(box_where))
+            if ('cmd' in box) == ('source' in box):
+                errors.append("{}: needs exactly one of cmd or source".format(box_where))
+            if 'id' in box and str(box['id']) in ids:
+                # reloads match boxes by id
+                errors.append("{}: another box has the same id".format(box_where))
+            ids.add(str(box.get('id')))
+            if 'source' in box and box.get('stream'):
+                errors.append("{}: stream only works with cmd, a source returns all its text at once".format(box_where))
+            if not auto:
+                for key in ('width', 'height'):
+                    if key not in box:
+                        errors.append("{}: missing {}".format(box_where, key))
+            _check_keys(box_where, box, BOX_KEYS, errors)
+    return errors
+
+
+def _cache_path(path):
+    return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.cache')
+
+
+def _cache_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size, CACHE_VERSION
+
+
+def load(path):
+    """
+    Returns the parsed, validated config at path.  Raises ConfigError listing every problem.
+
+    A pickled copy is kept next to the file and used for as long as the
+    file's path, mtime and size match.
+    """
+    key = _cache_key(path)
+    try:
+        with open(_cache_path(path), 'rb') as cached:
+            cached_key, properties = pickle.load(cached)
+        if cached_key == key:
+            return properties
+    except Exception:
+        # missing, stale or unreadable cache, parse the yaml instead.
+        pass
+
+    with open(path) as yaml_file:
+        try:
+            properties = yaml.load(yaml_file, Loader=Loader)
+        except yaml.YAMLError as e:
+            raise ConfigError("Can't parse {}: {}".format(path, e))
+    if not properties:
+        raise ConfigError("Your yaml file is empty: " + path)
+    errors = validate(properties)
+    if errors:
+        raise ConfigError("Problems in {}:\n  ".format(path) + '\n  '.join(errors))
+
+    try:
+        tmp = _cache_path(path) + '.tmp'
+        with open(tmp, 'wb') as cached:
+            pickle.dump((key, properties), cached, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, _cache_path(path))
+    except OSError:
+        pass
+    return properties
+
+
+def watch(path, on_change, interval=1.0, on_error=None):
+    """
+    Calls on_change() from a daemon thread every time the file at path changes.
+
+    Uses inotify when inotify_simple is installed, otherwise checks the
+    file's mtime, size and inode every interval seconds.  An exception from
+    on_change is passed to on_error and watching goes on.
+    """
+    target = _watch_inotify if inotify_simple else _watch_stat
+    thread = threading.Thread(target=target, args=(path, _guarded(on_change, on_error), interval), daemon=True)
+    thread.start()
+    return thread
+
+
+def _guarded(on_change, on_error):
+    def changed():
+        try:
+            on_change()
+        except Exception as e:
+            # an unexpected error in one reload mustn't end reloading for the rest of the session.
+            if on_error:
+                on_error(e)
+    return changed
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _watch_stat(path, on_change, interval):
+    last = _signature(path)
+    while True:
+        time.sleep(interval)
+        current = _signature(path)
+        # a missing file is usually an editor halfway through replacing it.
+        if current is None or current == last:
+            continue
+        last = current
+        on_change()
+
+
+def _watch_inotify(path, on_change, interval):
+    inotify = inotify_simple.INotify()
+    flags = inotify_simple.flags
+    # watch the directory, editors often save by renaming a new file over the old one.
+    inotify.add_watch(os.path.dirname(os.path.abspath(path)), flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+    name = os.path.basename(path)
+    while True:
+        # read_delay lets a burst of writes from one save arrive as one batch.
+        events = inotify.read(read_delay=int(interval * 100))
+        if any(event.name == name for event in events):
+            on_change()
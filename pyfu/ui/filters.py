@@ -0,0 +1,204 @@
+"""
+Cheap in-process stand-ins for grep, head, tail, cut, sort and uniq.
+
+A box can post-process the output of a shared command with a filter like
+`grep -v DEBUG | cut -d, -f1,3 | head 5` without starting any process.
+"""
+
+import re
+import shlex
+
+
+def compile_filter(spec):
+    """Turns a pipeline spec into a function from text to text.  Raises ValueError on a bad spec."""
+    stages = []
+    for args in _split_pipeline(spec):
+        if not args:
+            raise ValueError("empty filter stage in: {}".format(spec))
+        name = args[0]
+        if name not in _stages:
+            raise ValueError("unknown filter '{}', expected one of: {}".format(name, ', '.join(sorted(_stages))))
+        stages.append(_stages[name](args[1:]))
+
+    def apply(text):
+        lines = text.split('\n')
+        for stage in stages:
+            lines = stage(lines)
+        return '\n'.join(lines)
+    return apply
+
+
+def _split_pipeline(spec):
+    # only unquoted pipes separate stages, so grep 'ERROR|WARN' works.
+    lexer = shlex.shlex(spec, posix=True, punctuation_chars='|')
+    lexer.whitespace_split = True
+    pipeline = [[]]
+    for token in lexer:
+        if token == '|':
+            pipeline.append([])
+        else:
+            pipeline[-1].append(token)
+    return pipeline
+
+
+def _count(name, args, default=10):
+    """Reads head 5, head -5, head -n 5 or tail -n +5.  Returns (count, True if it had a +)."""
+    values = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '-n':
+            value, i = _option(args, i)
+        elif arg.startswith('-n') or (arg.startswith('-') and arg[1:].isdigit()):
+            value, i = arg[2:] if arg.startswith('-n') else arg[1:], i + 1
+        elif arg.startswith('-'):
+            raise ValueError("{} filter doesn't support {}".format(name, arg))
+        else:
+            value, i = arg, i + 1
+        values.append(value)
+    if len(values) > 1:
+        raise ValueError("{} filter takes one count, not {}".format(name, ' '.join(values)))
+    if not values:
+        return default, False
+    plus = values[0].startswith('+')
+    digits = values[0][1:] if plus else values[0]
+    if not digits.isdigit():
+        raise ValueError("{} filter needs a whole number of lines, not {}".format(name, values[0]))
+    return int(digits), plus
+
+
+def _grep(args):
+    invert = False
+    flags = 0
+    patterns = []
+    for arg in args:
+        if arg.startswith('-') and len(arg) > 1 and not patterns:
+            for flag in arg[1:]:
+                if flag == 'v':
+                    invert = True
+                elif flag == 'i':
+                    flags |= re.IGNORECASE
+                elif flag != 'E':
+                    raise ValueError("grep filter doesn't support -{}".format(flag))
+        else:
+            patterns.append(arg)
+    if len(patterns) != 1:
+        raise ValueError("grep filter needs exactly one pattern")
+    try:
+        regex = re.compile(patterns[0], flags)
+    except re.error as e:
+        raise ValueError("grep filter pattern {!r}: {}".format(patterns[0], e)) from e
+    return lambda lines: [line for line in lines if bool(regex.search(line)) != invert]
+
+
+def _head(args):
+    count, plus = _count('head', args)
+    if plus:
+        raise ValueError("head filter doesn't support +{}".format(count))
+    return lambda lines: lines[:count]
+
+
+def _tail(args):
+    count, plus = _count('tail', args)
+    if plus:
+        # tail -n +2 is everything from the second line on
+        return lambda lines: lines[max(0, count - 1):]
+    return lambda lines: lines[-count:] if count else []
+
+
+def _fields(spec):
+    # 1,3-5,7- -> python slices
+    ranges = []
+    for part in spec.split(','):
+        start, sep, end = part.partition('-')
+        start = int(start) - 1 if start else 0
+        if sep:
+            end = int(end) if end else None
+        else:
+            end = start + 1
+        ranges.append((start, end))
+    return ranges
+
+
+def _option(args, i):
+    # both -d, and -d ',' work
+    if len(args[i]) > 2:
+        return args[i][2:], i + 1
+    if i + 1 >= len(args):
+        raise ValueError("{} needs a value".format(args[i]))
+    return args[i + 1], i + 2
+
+
+def _cut(args):
+    delimiter = '\t'
+    fields = None
+    chars = None
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('-d'):
+            delimiter, i = _option(args, i)
+        elif arg.startswith('-f'):
+            value, i = _option(args, i)
+            fields = _fields(value)
+        elif arg.startswith('-c'):
+            value, i = _option(args, i)
+            chars = _fields(value)
+        else:
+            raise ValueError("cut filter doesn't support {}".format(arg))
+    if chars is not None:
+        return lambda lines: [''.join(line[s:e] for s, e in chars) for line in lines]
+    if fields is None:
+        raise ValueError("cut filter needs -f or -c")
+
+    def cut(lines):
+        result = []
+        for line in lines:
+            if delimiter not in line:
+                result.append(line)
+                continue
+            parts = line.split(delimiter)
+            picked = []
+            for start, end in fields:
+                picked.extend(parts[start:end])
+            result.append(delimiter.join(picked))
+        return result
+    return cut
+
+
+def _sort(args):
+    flags = ''
+    for arg in args:
+        if not arg.startswith('-') or len(arg) < 2 or arg[1:].strip('rn'):
+            raise ValueError("sort filter doesn't support {}".format(arg))
+        flags += arg[1:]
+    reverse = 'r' in flags
+    numeric = 'n' in flags
+
+    def key(line):
+        match = re.match(r'\s*(-?\d+(\.\d+)?)', line)
+        return float(match.group(1)) if match else 0.0
+    return lambda lines: sorted(lines, key=key if numeric else None, reverse=reverse)
+
+
+def _uniq(args):
+    if args:
+        raise ValueError("uniq filter doesn't support {}".format(args[0]))
+
+    def uniq(lines):
+        result = []
+        for line in lines:
+            if not result or result[-1] != line:
+                result.append(line)
+        return result
+    return uniq
+
+
+_stages = {
+    'grep': _grep,
+    'head': _head,
+    'tail': _tail,
+    'cut': _cut,
+    'sort': _sort,
+    'uniq': _uniq,
+}
@@ -0,0 +1,58 @@
+"""
+A termbox stand-in that draws into memory, for benchmarks and regression checks.
+"""
+
+BLANK = (ord(' '), 0, 0)
+
+
+class HeadlessTermbox(object):
+    """
+    Same change_cell/clear/present surface as termbox.Termbox, backed by an in-memory grid.
+
+    Cells outside the grid are dropped, like termbox does.  Every call is
+    counted so render cost can be measured.
+    """
+
+    def __init__(self, width=200, height=60):
+        self._width = width
+        self._height = height
+        self.grid = [[BLANK] * width for _ in range(height)]
+        self.change_cell_calls = 0
+        self.clear_calls = 0
+        self.present_calls = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def select_output_mode(self, mode):
+        pass
+
+    def change_cell(self, x, y, ch, fg, bg):
+        self.change_cell_calls += 1
+        if 0 <= x < self._width and 0 <= y < self._height:
+            self.grid[y][x] = (ch, fg, bg)
+
+    def clear(self):
+        self.clear_calls += 1
+        self.grid = [[BLANK] * self._width for _ in range(self._height)]
+
+    def present(self):
+        self.present_calls += 1
+
+    def text(self):
+        """The grid as lines of text, without colors."""
+        return '\n'.join(''.join(chr(cell[0]) for cell in row).rstrip() for row in self.grid)
+
+    def reset_counters(self):
+        self.change_cell_calls = 0
+        self.clear_calls = 0
+        self.present_calls = 0
@@ -0,0 +1,52 @@
+"""
+Row geometry for a dashboard, cached between frames.
+"""
+
+
+class Layout(object):
+    """
+    Keeps the height of every row of boxes and the screen row each one starts on.
+
+    Offsets are only recomputed from the first row whose height changed, so a
+    frame where no box changed height costs nothing.  version goes up every
+    time a box changes height, which tells the renderer it has to repaint
+    the whole screen instead of only the dirty boxes.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.heights = []
+        self.offsets = [0]
+        self.version = 0
+
+    def clear(self):
+        self.rows = []
+        self.heights = []
+        self.offsets = [0]
+        self.version += 1
+
+    def add(self, box):
+        while len(self.rows) <= box.row_index:
+            self.rows.append([])
+            self.heights.append(0)
+        self.rows[box.row_index].append(box)
+        self.box_resized(box)
+
+    def row_height(self, row_index):
+        if row_index >= len(self.heights):
+            return 0
+        return self.heights[row_index]
+
+    def starting_row(self, row_index):
+        while len(self.offsets) <= row_index:
+            i = len(self.offsets) - 1
+            self.offsets.append(self.offsets[i] + self.row_height(i))
+        return self.offsets[row_index]
+
+    def box_resized(self, box):
+        self.version += 1
+        i = box.row_index
+        height = max(b.calc_height() for b in self.rows[i])
+        if height != self.heights[i]:
+            self.heights[i] = height
+            del self.offsets[i + 1:]
@@ -0,0 +1,113 @@
+"""
+Per-box timing and size statistics for a dashboard.
+"""
+
+import collections
+import json
+import threading
+import time
+
+
+def _size(n):
+    for unit in ('B', 'KB', 'MB'):
+        if n < 1024:
+            return '{}{}'.format(round(n, 1), unit)
+        n /= 1024.0
+    return '{}GB'.format(round(n, 1))
+
+
+class RollingHistogram(object):
+    """Keeps the last `size` samples and answers percentile queries over them."""
+
+    def __init__(self, size=200):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class BoxMetrics(object):
+    def __init__(self):
+        self.cmd_time = RollingHistogram()
+        self.queue_wait = RollingHistogram()
+        self.output_bytes = RollingHistogram()
+        self.render_time = RollingHistogram()
+        self.refreshes = 0
+        self.redraws = 0
+
+
+class Metrics(object):
+    """
+    Collects BoxMetrics for every box of a dashboard.
+
+    With a path, every refresh is also appended to it as a JSON line.
+    """
+
+    def __init__(self, dashboard_name, path=None):
+        self.dashboard_name = dashboard_name
+        self.path = path
+        self.boxes = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def for_box(self, box):
+        with self.lock:
+            if box.id not in self.boxes:
+                self.boxes[box.id] = BoxMetrics()
+            return self.boxes[box.id]
+
+    def record_refresh(self, box, cmd_time, queue_wait, output_bytes, how):
+        """how is one of: ran, shared, cached, timeout."""
+        metrics = self.for_box(box)
+        metrics.refreshes += 1
+        if how in ('ran', 'timeout'):
+            metrics.cmd_time.add(cmd_time)
+            metrics.queue_wait.add(queue_wait)
+        metrics.output_bytes.add(output_bytes)
+        if self.path:
+            line = json.dumps({
+                'time': round(time.time(), 3),
+                'dashboard': self.dashboard_name,
+                'box': box.id,
+                'how': how,
+                'cmd_sec': round(cmd_time, 4),
+                'queue_sec': round(queue_wait, 4),
+                'bytes': output_bytes,
+                'render_p50_ms': round(metrics.render_time.percentile(50) * 1000, 3),
+                'redraws': metrics.redraws,
+            })
+            with self.lock:
+                with open(self.path, 'a') as output:
+                    output.write(line + '\n')
+
+    def record_render(self, box, seconds):
+        metrics = self.for_box(box)
+        metrics.redraws += 1
+        metrics.render_time.add(seconds)
+
+    def report(self, memory=None):
+        """memory maps box ids to the bytes each box holds, see Box.memory_usage."""
+        memory = memory or {}
+        lines = ['{:<16} {:>13} {:>9} {:>9} {:>10} {:>7} {:>7} {:>9}'.format(
+            'box', 'cmd p50/p90', 'queue p90', 'bytes p50', 'render p90', 'runs', 'redraws', 'memory')]
+        with self.lock:
+            items = list(self.boxes.items())
+        for box_id, m in items:
+            lines.append('{:<16} {:>13} {:>9} {:>9} {:>10} {:>7} {:>7} {:>9}'.format(
+                str(box_id)[:16],
+                '{}/{}s'.format(round(m.cmd_time.percentile(50), 2), round(m.cmd_time.percentile(90), 2)),
+                '{}s'.format(round(m.queue_wait.percentile(90), 2)),
+                int(m.output_bytes.percentile(50)),
+                '{}ms'.format(round(m.render_time.percentile(90) * 1000, 2)),
+                m.refreshes,
+                m.redraws,
+                _size(memory[box_id]) if box_id in memory else '-'))
+        return '\n'.join(lines)
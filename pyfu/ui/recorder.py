@@ -0,0 +1,289 @@
+"""
+Records every box result of a dashboard, and plays recordings back.
+
+A recording is two append-only files in the dashboard's record-dir:
+
+* `<name>.log` - one record per box result: a fixed header (time, kind,
+  box id length, payload length), the box id and a payload.  Output is
+  stored as a line delta against the previous output of the same box and
+  zlib compressed.  Refreshes that only change the status line store just
+  the status.
+* `<name>.idx` - (time, offset) of every checkpoint.  At a checkpoint the
+  full output of every box is written again, so playback can start there
+  without reading anything before it.
+"""
+
+import bisect
+import datetime
+import difflib
+import fcntl
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+HEADER = struct.Struct('<dBHI')
+INDEX_ENTRY = struct.Struct('<dQ')
+
+FULL = 0
+DELTA = 1
+STATUS = 2
+
+# seconds between checkpoints, the most playback has to read to reach any moment
+CHECKPOINT_SEC = 60
+
+
+def parse_time(text, now=None):
+    """
+    Returns the timestamp for `20m` (or `-20m`) ago, also s, h and d, `14:05[:30]`
+    (the last time it was that time of day) or an ISO date and time.  Raises ValueError.
+    """
+    now = time.time() if now is None else now
+    ago = re.match(r'^-?(\d+(?:\.\d+)?)([smhd])$', text.strip())
+    if ago:
+        return now - float(ago.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[ago.group(2)]
+    if re.match(r'^\d{1,2}:\d{2}(:\d{2})?$', text.strip()):
+        today = datetime.datetime.fromtimestamp(now)
+        clock = datetime.datetime.strptime(text.strip(), '%H:%M:%S' if text.count(':') == 2 else '%H:%M')
+        when = today.replace(hour=clock.hour, minute=clock.minute, second=clock.second, microsecond=0)
+        if when.timestamp() > now:
+            when -= datetime.timedelta(days=1)
+        return when.timestamp()
+    return datetime.datetime.fromisoformat(text.strip()).timestamp()
+
+
+def delta(old, new):
+    """
+    Returns the ops that turn the list of lines old into new.
+
+    [i, j] copies old[i:j], a string is a new line.
+    """
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        else:
+            ops.extend(new[j1:j2])
+    return ops
+
+
+def patch(old, ops):
+    new = []
+    for op in ops:
+        if isinstance(op, list):
+            new.extend(old[op[0]:op[1]])
+        else:
+            new.append(op)
+    return new
+
+
+class Recorder(object):
+    """A dashboard listener that appends every box result to the dashboard's recording."""
+
+    def __init__(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        self.log = open(os.path.join(directory, name + '.log'), 'ab')
+        try:
+            # two writers would interleave deltas against different bases.
+            fcntl.flock(self.log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.log.close()
+            raise
+        self.index = open(os.path.join(directory, name + '.idx'), 'ab')
+        self.lock = threading.Lock()
+        self.lines = {}
+        self.statuses = {}
+        self.checkpointed = 0
+
+    def record(self, box, status_only=False):
+        lines = box.contents.split('\n')
+        with self.lock:
+            now = time.time()
+            if now - self.checkpointed >= CHECKPOINT_SEC:
+                self._checkpoint(now)
+            previous = self.lines.get(box.id)
+            if lines == previous:
+                if box.status == self.statuses.get(box.id):
+                    # a repaint of what was already recorded, e.g. after scrolling.
+                    return
+                self._write(now, STATUS, box.id, (box.status or '').encode('utf8'))
+            elif previous is None:
+                self._write(now, FULL, box.id, self._payload(box.status, contents=lines))
+            else:
+                self._write(now, DELTA, box.id, self._payload(box.status, delta=delta(previous, lines)))
+            self.lines[box.id] = lines
+            self.statuses[box.id] = box.status
+            self.log.flush()
+
+    def _checkpoint(self, now):
+        self.index.write(INDEX_ENTRY.pack(now, self.log.tell()))
+        self.index.flush()
+        for box_id, lines in self.lines.items():
+            self._write(now, FULL, box_id, self._payload(self.statuses.get(box_id), contents=lines))
+        self.checkpointed = now
+
+    def _payload(self, status, **output):
+        output['status'] = status
+        return zlib.compress(json.dumps(output).encode('utf8'))
+
+    def _write(self, now, kind, box_id, payload):
+        box_id = box_id.encode('utf8')
+        self.log.write(HEADER.pack(now, kind, len(box_id), len(payload)) + box_id + payload)
+
+
+class Reader(object):
+    """Reads a recording back as (time, box id, status, contents)."""
+
+    def __init__(self, directory, name):
+        self.log_path = os.path.join(directory, name + '.log')
+        self.index_path = os.path.join(directory, name + '.idx')
+        if not os.path.exists(self.log_path):
+            raise ValueError('nothing recorded yet: ' + self.log_path)
+
+    def checkpoints(self):
+        with open(self.index_path, 'rb') as index:
+            data = index.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, i) for i in range(0, usable, INDEX_ENTRY.size)]
+
+    def read_from(self, start):
+        """Yields every record from the last checkpoint at or before start."""
+        checkpoints = self.checkpoints()
+        i = max(0, bisect.bisect_right([t for t, _ in checkpoints], start) - 1)
+        offset = checkpoints[i][1] if checkpoints else 0
+        lines = {}
+        statuses = {}
+        with open(self.log_path, 'rb') as log:
+            log.seek(offset)
+            while True:
+                header = log.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                when, kind, id_length, length = HEADER.unpack(header)
+                box_id = log.read(id_length).decode('utf8')
+                payload = log.read(length)
+                if len(payload) < length:
+                    # the recorder was stopped halfway through a record
+                    return
+                if kind == STATUS:
+                    if box_id not in lines:
+                        continue
+                    statuses[box_id] = payload.decode('utf8')
+                else:
+                    output = json.loads(zlib.decompress(payload).decode('utf8'))
+                    if kind == FULL:
+                        lines[box_id] = output['contents']
+                    elif box_id in lines:
+                        lines[box_id] = patch(lines[box_id], output['delta'])
+                    else:
+                        continue
+                    statuses[box_id] = output['status']
+                yield when, box_id, statuses[box_id], '\n'.join(lines[box_id])
+
+
+class ReplayScheduler(object):
+    """
+    Takes the place of a scheduler to play a recording back instead of running commands.
+
+    The replay clock runs at speed times real time and can be paused or
+    moved; output recorded before the start time is applied at once.
+    """
+
+    def __init__(self, dashboard, reader, start, speed=1.0):
+        self.dashboard = dashboard
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.position = start
+        self.wall = time.time()
+        self.speed = speed
+        self.paused = False
+        self.seeking = False
+
+    def start(self):
+        thread = threading.Thread(target=self._play, daemon=True)
+        thread.start()
+
+    def add(self, box):
+        pass
+
+    def refresh_now(self, box):
+        pass
+
+    def queue_depth(self):
+        return 0
+
+    def now(self):
+        with self.lock:
+            if self.paused:
+                return self.position
+            return self.position + (time.time() - self.wall) * self.speed
+
+    def _set(self, position=None, speed=None, paused=None, seek=False):
+        position = self.now() if position is None else position
+        with self.lock:
+            self.position = position
+            self.wall = time.time()
+            if speed is not None:
+                self.speed = speed
+            if paused is not None:
+                self.paused = paused
+            self.seeking = self.seeking or seek
+
+    def pause(self):
+        self._set(paused=not self.paused)
+
+    def faster(self):
+        self._set(speed=self.speed * 2)
+
+    def slower(self):
+        self._set(speed=self.speed / 2)
+
+    def jump(self, seconds):
+        self._set(position=self.now() + seconds, seek=seconds < 0)
+
+    def _play(self):
+        while True:
+            with self.lock:
+                self.seeking = False
+            # after a jump back, boxes show nothing until their first record.
+            for box in self.dashboard.boxes:
+                box.contents = ''
+                self.dashboard.mark_dirty(box)
+            for when, box_id, status, contents in self.reader.read_from(self.now()):
+                if not self._wait_until(when):
+                    break
+                self._show(box_id, status, contents)
+            else:
+                # the end of the recording, wait for a jump back.
+                self._wait_until(float('inf'))
+
+    def _wait_until(self, when):
+        """Sleeps until the replay clock reaches when.  False if a jump back means starting over."""
+        shown = None
+        while True:
+            with self.lock:
+                if self.seeking:
+                    return False
+            now = self.now()
+            if now >= when:
+                return True
+            if shown != int(now):
+                shown = int(now)
+                self._show_clock(now)
+            time.sleep(min(0.25, max(0.01, (when - now) / max(self.speed, 0.01))))
+
+    def _show_clock(self, now):
+        self.dashboard.show_notice('{} {}x{} - space pause, +/- speed, </> 1 minute'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+            round(self.speed, 2), ' paused' if self.paused else ''), header='replay')
+
+    def _show(self, box_id, status, contents):
+        for box in self.dashboard.boxes:
+            if box.id == box_id:
+                box.contents = contents
+                box.status = status
+                self.dashboard.mark_dirty(box)
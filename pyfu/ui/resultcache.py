@@ -0,0 +1,96 @@
+"""
+Command output cache shared by every dashboard process on the host.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_DIR = '/tmp/dashboard-cache'
+
+
+class Entry(object):
+    def __init__(self, contents, mtime):
+        self.contents = contents
+        self.mtime = mtime
+
+
+class ResultCache(object):
+    """
+    One file per command, named after a hash of the command.
+
+    Writers replace the file atomically with os.replace, so a reader never
+    sees half an output.  Reads are memoized by mtime, so a fresh entry
+    that was already read costs one stat.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self.memo = {}
+        self.lock = threading.Lock()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # like /tmp: anyone on the host can publish, nobody can delete someone else's file.
+            os.chmod(self.directory, 0o1777)
+        except OSError:
+            pass
+
+    def path(self, cmd):
+        return os.path.join(self.directory, hashlib.sha1(cmd.encode('utf8')).hexdigest())
+
+    def get(self, cmd, max_age):
+        """Returns the cached Entry for cmd if it is younger than max_age seconds, else None."""
+        path = self.path(cmd)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if mtime <= time.time() - max_age:
+            return None
+        with self.lock:
+            entry = self.memo.get(path)
+            if entry and entry.mtime == mtime:
+                return entry
+        try:
+            with open(path, encoding='utf8') as cached:
+                entry = Entry(cached.read(), mtime)
+        except OSError:
+            return None
+        with self.lock:
+            self.memo[path] = entry
+        return entry
+
+    def touch(self, cmd):
+        """Marks an unchanged entry as freshly produced without rewriting it."""
+        path = self.path(cmd)
+        try:
+            os.utime(path)
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        with self.lock:
+            entry = self.memo.get(path)
+            if entry:
+                self.memo[path] = Entry(entry.contents, mtime)
+
+    def put(self, cmd, contents):
+        path = self.path(cmd)
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w', encoding='utf8') as output:
+                output.write(contents)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            # another user's entry can't be replaced in a sticky directory; keep our result to ourselves.
+            if tmp and os.path.exists(tmp):
+                os.unlink(tmp)
+            return None
+        entry = Entry(contents, mtime)
+        with self.lock:
+            self.memo[path] = entry
+        return entry
@@ -0,0 +1,358 @@
+"""
+Schedulers that decide when dashboard boxes run their commands.
+"""
+
+import _thread
+import asyncio
+import datetime
+import heapq
+import itertools
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# lower runs first
+PRIORITY_FOCUSED = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_BACKGROUND = 2
+
+
+def kill_process_group(pid):
+    """Kills a command started with start_new_session, along with everything it spawned."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def error_output(e):
+    """What a box shows when running its command raised, in the same form as a failing source."""
+    return 'error: {}: {}'.format(type(e).__name__, e)
+
+
+class SingleFlight(object):
+    """
+    Runs a call once for every caller that asks for the same key while it is still running.
+
+    Callers that arrive while the first one (the leader) is running wait for
+    its result instead of running their own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def running(self, key):
+        with self.lock:
+            return key in self.calls
+
+    def do(self, key, func):
+        """Returns (result, shared), where shared is True if another caller did the work."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None}
+        if not leader:
+            call['done'].wait()
+            return call['result'], True
+        try:
+            call['result'] = func()
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+        return call['result'], False
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads that run jobs in priority order.
+
+    Each job is called with the number of seconds it waited in the queue.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def submit(self, priority, job):
+        with self.lock:
+            while len(self.workers) < self.size:
+                worker = threading.Thread(target=self._work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        done = threading.Event()
+        self.queue.put((priority, next(self.counter), time.time(), job, done))
+        return done
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _work(self):
+        while True:
+            priority, _, queued_at, job, done = self.queue.get()
+            try:
+                job(time.time() - queued_at)
+            finally:
+                done.set()
+
+
+class ThreadScheduler(object):
+    """
+    The original scheduler: every box refreshes on its own timer thread.
+
+    With max-concurrency set, the commands themselves run on a shared
+    WorkerPool so only that many run at once.
+    """
+
+    def __init__(self, dashboard, max_concurrency=0):
+        self.dashboard = dashboard
+        self.pool = WorkerPool(max_concurrency) if max_concurrency > 0 else None
+
+    def start(self):
+        for box in self.dashboard.boxes:
+            box.start_refreshing()
+
+    def add(self, box):
+        """Starts refreshing a box added after start."""
+        box.start_refreshing()
+
+    def refresh_now(self, box):
+        _thread.start_new_thread(self.run, (box,))
+
+    def run(self, box, use_cache=False):
+        if box.stream:
+            # streaming commands may never exit, so they don't take a pool slot.
+            box.stream_output()
+            return
+        if use_cache and box.show_cached():
+            return
+        # a box whose command is already running for another box waits for that result
+        # instead of running it again or taking a pool slot.
+        result, shared = self.dashboard.flights.do(box.flight_key(), lambda: self._run_cmd(box))
+        if result is None:
+            return
+        contents, before, queue_wait = result
+        box.show_result(contents, before, queue_wait, shared)
+
+    def _run_cmd(self, box):
+        """
+        Returns (output, started, seconds queued).  output is None if the command timed out.
+        Returns None instead if the box was stopped while it waited for a pool slot.
+        """
+        if not self.pool:
+            before = datetime.datetime.now()
+            return self._output(box), before, 0
+        generation = box.generation
+        result = []
+
+        def job(wait):
+            if box.stopped or box.generation != generation:
+                # paused or reloaded while queued: don't start a command nobody will see.
+                return
+            before = datetime.datetime.now()
+            result.append((self._output(box), before, wait))
+        self.pool.submit(self.dashboard.priority(box), job).wait()
+        return result[0] if result else None
+
+    def _output(self, box):
+        # an exception here would end the box's refresh thread for good.
+        try:
+            return box.run_cmd()
+        except Exception as e:
+            return error_output(e)
+
+    def queue_depth(self):
+        return self.pool.depth() if self.pool else 0
+
+
+class AsyncScheduler(object):
+    """
+    Runs every box command on a single asyncio event loop.
+
+    Boxes wait in a heap ordered by the time they are next due, so the
+    whole dashboard needs one thread no matter how many boxes it has.
+    """
+
+    def __init__(self, dashboard, max_concurrency=0):
+        self.dashboard = dashboard
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.new_event_loop()
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = None
+        self.running = 0
+        self.waiting = []
+        self.inflight = {}
+
+    def start(self):
+        if sys.version_info < (3, 8):
+            # older pythons can only reap child processes through a watcher attached from the main thread.
+            asyncio.get_child_watcher().attach_loop(self.loop)
+        for box in self.dashboard.boxes:
+            self._push(box, 0)
+        thread = threading.Thread(target=self._run_loop, daemon=True)
+        thread.start()
+
+    def add(self, box):
+        """Starts refreshing a box added after start."""
+        self.loop.call_soon_threadsafe(self._push, box, 0)
+
+    def refresh_now(self, box):
+        self.loop.call_soon_threadsafe(self._spawn, box, box.generation, False)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._run())
+
+    def _push(self, box, due, generation=None):
+        generation = box.generation if generation is None else generation
+        heapq.heappush(self.heap, (due, next(self.counter), box, generation))
+        if self.wakeup:
+            self.wakeup.set()
+
+    def _spawn(self, box, generation, reschedule=True):
+        self.loop.create_task(self._refresh(box, generation, reschedule))
+
+    async def _run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            if self.heap:
+                timeout = self.heap[0][0] - self.loop.time()
+            else:
+                timeout = None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            due, _, box, generation = heapq.heappop(self.heap)
+            # a box stopped or resumed since it was queued is left to its newer entry
+            if not box.stopped and generation == box.generation:
+                self._spawn(box, generation)
+
+    def queue_depth(self):
+        return len(self.waiting)
+
+    async def _acquire(self, priority):
+        if not self.max_concurrency or (self.running < self.max_concurrency and not self.waiting):
+            self.running += 1
+            return
+        slot = self.loop.create_future()
+        heapq.heappush(self.waiting, (priority, next(self.counter), slot))
+        await slot
+
+    def _release(self):
+        # a finished command hands its slot straight to the most urgent waiter.
+        if self.waiting:
+            _, _, slot = heapq.heappop(self.waiting)
+            slot.set_result(None)
+        else:
+            self.running -= 1
+
+    async def _stream(self, box):
+        if box.streaming:
+            return
+        box.streaming = True
+        try:
+            process = await asyncio.create_subprocess_shell(
+                box.refresh_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                start_new_session=True
+            )
+            box.start_stream()
+            read = None
+            while True:
+                if box.stopped:
+                    kill_process_group(process.pid)
+                    if read is not None:
+                        read.cancel()
+                    break
+                if read is None:
+                    read = self.loop.create_task(process.stdout.read(65536))
+                done, _ = await asyncio.wait([read], timeout=self.dashboard.poll_time())
+                if done:
+                    chunk = read.result()
+                    read = None
+                    if not chunk:
+                        break
+                    box.feed(chunk)
+                box.flush_stream()
+            box.end_stream(await process.wait())
+        finally:
+            # also when stopped, so a resumed box can start streaming again.
+            box.streaming = False
+
+    async def _refresh(self, box, generation, reschedule=True):
+        try:
+            if box.stream:
+                await self._stream(box)
+            elif not (reschedule and box.show_cached()):
+                key = box.flight_key()
+                shared = key in self.inflight
+                if shared:
+                    # the same command is already running for another box, share its output.
+                    result = await asyncio.shield(self.inflight[key])
+                else:
+                    flight = self.inflight[key] = self.loop.create_future()
+                    result = None
+                    try:
+                        result = await self._run_cmd(box, generation)
+                    except Exception as e:
+                        # every box sharing the run shows the error, not a timeout.
+                        result = (error_output(e), datetime.datetime.now(), 0)
+                    finally:
+                        del self.inflight[key]
+                        flight.set_result(result)
+                if result is not None:
+                    contents, before, queue_wait = result
+                    box.show_result(contents, before, queue_wait, shared)
+        finally:
+            # whatever happened to this run, the box keeps its schedule.
+            if reschedule and box.refresh_rate > 0 and not box.stopped:
+                self._push(box, self.loop.time() + box.refresh_rate, generation)
+
+    async def _run_cmd(self, box, generation):
+        """
+        Returns (output, started, seconds queued).  output is None if the command timed out.
+        Returns None instead if the box was stopped while it waited for a slot.
+        """
+        queued_at = time.time()
+        await self._acquire(self.dashboard.priority(box))
+        try:
+            if box.stopped or box.generation != generation:
+                # paused or reloaded while queued: don't start a command nobody will see.
+                return None
+            before = datetime.datetime.now()
+            if box.source:
+                contents = await self.loop.run_in_executor(None, box.run_source)
+                return contents, before, before.timestamp() - queued_at
+            if self.dashboard.shells:
+                contents = await self.loop.run_in_executor(None, self.dashboard.shells.run, box.refresh_cmd, box.timeout or None)
+                return contents, before, before.timestamp() - queued_at
+            process = await asyncio.create_subprocess_shell(
+                box.refresh_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                start_new_session=box.timeout > 0
+            )
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), box.timeout or None)
+            except asyncio.TimeoutError:
+                kill_process_group(process.pid)
+                await process.wait()
+                return None, before, before.timestamp() - queued_at
+        finally:
+            self._release()
+        return stdout.decode('utf8', 'replace').strip(), before, before.timestamp() - queued_at
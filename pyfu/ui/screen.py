@@ -0,0 +1,77 @@
+"""
+Back-buffered drawing surface that only sends changed cells to termbox.
+"""
+
+import threading
+
+BLANK = (ord(' '), 0, 0)
+
+
+class Screen(object):
+    """
+    Wraps a termbox with the same change_cell/clear/present surface.
+
+    Cells are drawn into a back buffer.  present() compares it with the
+    frame that was last sent to termbox and only calls change_cell for
+    cells that differ.
+    """
+
+    def __init__(self, termbox):
+        self.termbox = termbox
+        self.front = {}
+        self.back = {}
+        self.lock = threading.RLock()
+        self.full_repaint = True
+        self.frames = 0
+        self.cells_touched = 0
+        self.total_cells_touched = 0
+
+    def change_cell(self, x, y, ch, fg, bg):
+        with self.lock:
+            self.back[(x, y)] = (ch, fg, bg)
+
+    def change_cells(self, cells):
+        """Draws many cells at once.  cells is an iterable of ((x, y), (ch, fg, bg))."""
+        with self.lock:
+            self.back.update(cells)
+
+    def clear(self):
+        with self.lock:
+            self.back = {}
+
+    def invalidate(self):
+        # termbox drops its own buffers on resize, so the next frame must be sent in full.
+        with self.lock:
+            self.full_repaint = True
+
+    def present(self):
+        with self.lock:
+            touched = 0
+            if self.full_repaint:
+                self.termbox.clear()
+                for (x, y), (ch, fg, bg) in self.back.items():
+                    if (ch, fg, bg) != BLANK:
+                        self.termbox.change_cell(x, y, ch, fg, bg)
+                        touched += 1
+                self.full_repaint = False
+            else:
+                for pos, cell in self.back.items():
+                    if self.front.get(pos, BLANK) != cell:
+                        self.termbox.change_cell(pos[0], pos[1], cell[0], cell[1], cell[2])
+                        touched += 1
+                for pos in self.front:
+                    if pos not in self.back and self.front[pos] != BLANK:
+                        self.termbox.change_cell(pos[0], pos[1], BLANK[0], BLANK[1], BLANK[2])
+                        touched += 1
+            self.front = dict(self.back)
+            self.frames += 1
+            self.cells_touched = touched
+            self.total_cells_touched += touched
+            self.termbox.present()
+            return touched
+
+    def __getattr__(self, name):
+        if name == 'termbox':
+            raise AttributeError(name)
+        # everything else (poll_event, select_output_mode, ...) goes straight to termbox.
+        return getattr(self.termbox, name)
@@ -0,0 +1,115 @@
+"""
+Numeric time series for `type: series` boxes.
+"""
+
+import array
+import math
+import re
+
+SPARKS = '▁▂▃▄▅▆▇█'
+
+# a number standing on its own: "1.5, 2.3" and "50%" count, "42ms" and "v1.2.3" don't.
+# nan and inf are matched too, so they hold their column's place.
+NUMBER = re.compile(r'(?<![\w.-])[-+]?(?:\d+(?:\.\d*)?|\.\d+|(?i:nan|inf(?:inity)?))(?:[eE][-+]?\d+)?(?![\w.])')
+
+# the largest value a Ring's 4 byte floats hold, anything bigger becomes inf.
+FLOAT_MAX = 3.4028234663852886e38
+
+
+class Ring(object):
+    """
+    The last size floats, kept in a fixed-size typed array.
+
+    4 bytes per sample, however many have been added.
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.values = array.array('f', bytes(4 * self.size))
+        self.count = 0
+        self.next = 0
+
+    def append(self, value):
+        self.values[self.next] = value
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def last(self, n):
+        """The newest n values (or fewer), oldest first."""
+        n = min(n, self.count)
+        start = (self.next - n) % self.size
+        if start + n <= self.size:
+            return self.values[start:start + n]
+        return self.values[start:] + self.values[:self.next]
+
+    def stats(self):
+        """(min, avg, max) of everything kept."""
+        values = self.last(self.count)
+        return min(values), sum(values) / len(values), max(values)
+
+
+def sparkline(values):
+    lo = min(values)
+    hi = max(values)
+    if hi == lo:
+        return SPARKS[0] * len(values)
+    scale = (len(SPARKS) - 1) / (hi - lo)
+    return ''.join(SPARKS[int((v - lo) * scale)] for v in values)
+
+
+def _number(value):
+    return '{:.4g}'.format(value)
+
+
+class Series(object):
+    """
+    One Ring per column of numbers a command prints.
+
+    Each refresh adds one sample per column.  render() draws a sparkline of
+    the newest samples that fit, the last value and min/avg/max.
+    """
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.rings = []
+        self.names = []
+        self.error = None
+
+    def add(self, output):
+        values = []
+        for token in NUMBER.findall(output):
+            value = float(token)
+            # nan or inf can't be drawn, and would stay in the ring for every later render.
+            values.append(value if math.isfinite(value) and abs(value) <= FLOAT_MAX else None)
+        if not any(value is not None for value in values):
+            self.error = 'no number in output: ' + output.strip()[:60]
+            return
+        self.error = None
+        while len(self.rings) < len(values):
+            self.rings.append(Ring(self.samples))
+        for ring, value in zip(self.rings, values):
+            if value is not None:
+                ring.append(value)
+
+    def memory_usage(self):
+        return sum(ring.values.buffer_info()[1] * ring.values.itemsize for ring in self.rings)
+
+    def render(self, width):
+        lines = []
+        for i, ring in enumerate(self.rings):
+            if not ring.count:
+                continue
+            if i < len(self.names):
+                label = self.names[i] + ' '
+            elif len(self.rings) > 1:
+                label = '#{} '.format(i + 1)
+            else:
+                label = ''
+            low, avg, high = ring.stats()
+            stats = ' {} (min {} avg {} max {})'.format(
+                _number(ring.last(1)[0]), _number(low), _number(avg), _number(high))
+            spark_width = max(1, width - len(label) - len(stats))
+            lines.append(label + sparkline(ring.last(spark_width)) + stats)
+        if self.error:
+            lines.append(self.error)
+        return '\n'.join(lines)
@@ -0,0 +1,124 @@
+"""
+Long-lived bash coprocesses that run box commands without a fork/exec of /bin/sh per refresh.
+"""
+
+import os
+import queue
+import selectors
+import shlex
+import subprocess
+import time
+import uuid
+
+from pyfu.ui.scheduler import kill_process_group
+
+
+class ShellDied(Exception):
+    pass
+
+
+class Shell(object):
+    """
+    One bash process reading commands from stdin.
+
+    Each command runs in a subshell, so a cd or exit in it can't affect the
+    next one, and is followed by a unique sentinel line that marks the end of
+    its output.
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ['bash', '--noprofile', '--norc'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+        self.fd = self.process.stdout.fileno()
+        os.set_blocking(self.fd, False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.fd, selectors.EVENT_READ)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        kill_process_group(self.process.pid)
+        self.process.wait()
+        self.selector.close()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def run(self, cmd, timeout=None):
+        """Returns the command's output, or None if it ran longer than timeout.  Raises ShellDied."""
+        sentinel = uuid.uuid4().hex.encode('ascii')
+        script = '( eval {} ) </dev/null 2>&1; printf "\\n%s\\n" {}\n'.format(shlex.quote(cmd), sentinel.decode('ascii'))
+        try:
+            self.process.stdin.write(script.encode('utf8'))
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            raise ShellDied()
+        marker = b'\n' + sentinel + b'\n'
+        output = b''
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            wait = None
+            if deadline:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    return None
+            if not self.selector.select(timeout=wait):
+                continue
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                raise ShellDied()
+            output += chunk
+            # the marker can only be at the very end, nothing else is written until the next command.
+            if output.endswith(marker):
+                return output[:-len(marker)].decode('utf8', 'replace').strip()
+
+
+class ShellPool(object):
+    """
+    A fixed number of Shells, started on first use.
+
+    A shell that crashed is replaced before it is handed out again, and a
+    shell whose command timed out is killed along with the command.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.shells = queue.Queue()
+        for _ in range(size):
+            self.shells.put(None)
+        self.respawns = 0
+
+    def run(self, cmd, timeout=None):
+        """
+        Returns the command's output, or None if it ran longer than timeout.
+        A command that kills its shell every time returns an error instead.
+        """
+        shell = self.shells.get()
+        try:
+            for attempt in range(2):
+                if shell is None or not shell.alive():
+                    shell = self._respawn(shell)
+                try:
+                    output = shell.run(cmd, timeout)
+                except ShellDied:
+                    # the shell crashed under the command, try once more on a fresh one.
+                    shell = self._respawn(shell)
+                    continue
+                if output is None:
+                    shell = self._respawn(shell)
+                return output
+            # None would be reported as a timeout, which this isn't.
+            return 'error: the shell died running this command, twice'
+        finally:
+            self.shells.put(shell)
+
+    def _respawn(self, shell):
+        if shell is not None:
+            self.respawns += 1
+            shell.kill()
+        return Shell()
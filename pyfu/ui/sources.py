@@ -0,0 +1,205 @@
+"""
+In-process data sources for dashboard boxes.
+
+A box with `source: cpu` or `source: python:mymodule.myfunc` calls a Python
+function instead of running a shell command.  The function returns the text
+to show.  Other packages can register sources under the
+`pyfu.dashboard.sources` entry point group.
+"""
+
+import functools
+import importlib
+import os
+import shutil
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ENTRY_POINT_GROUP = 'pyfu.dashboard.sources'
+
+
+def _human(size):
+    for unit in ['B', 'K', 'M', 'G']:
+        if abs(size) < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f}T'.format(size)
+
+
+_last_cpu_times = {}
+
+
+def _cpu_times():
+    """(total, idle) ticks of all cpus as 'cpu' and of each one as 'cpuN'.  idle + iowait count as idle."""
+    if psutil:
+        times = [psutil.cpu_times()] + psutil.cpu_times(percpu=True)
+        names = ['cpu'] + ['cpu{}'.format(i) for i in range(len(times) - 1)]
+        return {name: (sum(t), t.idle + getattr(t, 'iowait', 0)) for name, t in zip(names, times)}
+    cpus = {}
+    if not os.path.exists('/proc/stat'):
+        return cpus
+    with open('/proc/stat') as stat:
+        for line in stat:
+            if line.startswith('cpu'):
+                parts = line.split()
+                values = [int(v) for v in parts[1:]]
+                cpus[parts[0]] = (sum(values), values[3] + (values[4] if len(values) > 4 else 0))
+    return cpus
+
+
+def cpu(last=None):
+    """
+    Load averages and CPU busy percent since the previous call.
+
+    last holds the previous call's counters.  Every box gets its own (see
+    resolve), so two cpu boxes don't measure each other's intervals.
+    """
+    last = _last_cpu_times if last is None else last
+    lines = ['load {:.2f} {:.2f} {:.2f}'.format(*os.getloadavg())]
+    cpus = _cpu_times()
+    for name, (total, idle) in sorted(cpus.items(), key=lambda item: (item[0] != 'cpu', len(item[0]), item[0])):
+        last_total, last_idle = last.get(name, (0, 0))
+        busy = 0.0
+        if total > last_total:
+            busy = 100.0 * (1 - float(idle - last_idle) / (total - last_total))
+        lines.append('{:<6} {:5.1f}%'.format('total' if name == 'cpu' else name, busy))
+    last.update(cpus)
+    return '\n'.join(lines)
+
+
+def memory():
+    """Used and available memory and swap."""
+    if psutil:
+        mem = psutil.virtual_memory()
+        swap = psutil.swap_memory()
+        total, available, swap_total, swap_free = mem.total, mem.available, swap.total, swap.free
+    else:
+        info = {}
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                key, value = line.split(':', 1)
+                info[key] = int(value.split()[0]) * 1024
+        total = info['MemTotal']
+        available = info.get('MemAvailable', info['MemFree'])
+        swap_total = info.get('SwapTotal', 0)
+        swap_free = info.get('SwapFree', 0)
+    used = total - available
+    swap_used = swap_total - swap_free
+    return '\n'.join([
+        'mem  {:>8} / {:>8} used ({:.1f}%)'.format(_human(used), _human(total), 100.0 * used / max(1, total)),
+        'mem  {:>8} available'.format(_human(available)),
+        'swap {:>8} / {:>8} used'.format(_human(swap_used), _human(swap_total)),
+    ])
+
+
+def disk(path=None):
+    """Usage of the filesystem holding path, or without one of every mounted filesystem (psutil) or /."""
+    if path is not None:
+        paths = [path]
+    elif psutil:
+        paths = [p.mountpoint for p in psutil.disk_partitions()]
+    else:
+        paths = ['/']
+    lines = []
+    for mount in paths:
+        try:
+            usage = shutil.disk_usage(mount)
+        except OSError:
+            continue
+        lines.append('{:<20} {:>8} / {:>8} ({:.0f}%)'.format(
+            mount, _human(usage.used), _human(usage.total), 100.0 * usage.used / max(1, usage.total)))
+    return '\n'.join(lines)
+
+
+def processes():
+    """Process count, by state when it can be read."""
+    states = {}
+    if psutil:
+        for process in psutil.process_iter(['status']):
+            status = process.info['status']
+            states[status] = states.get(status, 0) + 1
+    else:
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(pid)) as stat:
+                    state = stat.read().rsplit(')', 1)[1].split()[0]
+            except (OSError, IndexError):
+                continue
+            states[state] = states.get(state, 0) + 1
+    lines = ['processes {}'.format(sum(states.values()))]
+    lines.extend('  {:<10} {}'.format(state, count) for state, count in sorted(states.items()))
+    return '\n'.join(lines)
+
+
+def uptime():
+    if psutil:
+        seconds = time.time() - psutil.boot_time()
+    else:
+        with open('/proc/uptime') as up:
+            seconds = float(up.read().split()[0])
+    days, rest = divmod(int(seconds), 86400)
+    hours, rest = divmod(rest, 3600)
+    return 'up {}d {}h {}m, load {:.2f} {:.2f} {:.2f}'.format(days, hours, rest // 60, *os.getloadavg())
+
+
+builtin = {
+    'cpu': cpu,
+    'memory': memory,
+    'disk': disk,
+    'processes': processes,
+    'uptime': uptime,
+}
+
+# built-in sources that compare with their previous call, and so need state of their own per box
+_per_box = {
+    'cpu': lambda: functools.partial(cpu, last={}),
+}
+
+
+def _entry_points():
+    try:
+        from importlib import metadata
+    except ImportError:
+        return {}
+    eps = metadata.entry_points()
+    if hasattr(eps, 'select'):
+        found = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        found = eps.get(ENTRY_POINT_GROUP, [])
+    return {ep.name: ep for ep in found}
+
+
+def resolve(spec):
+    """
+    Finds the function for a box source.
+
+    spec is `python:module.func`, the name of a built-in source, or the name
+    of an entry point in the pyfu.dashboard.sources group.  Raises ValueError
+    if nothing matches.
+    """
+    if spec.startswith('python:'):
+        module_name, _, func_name = spec[len('python:'):].rpartition('.')
+        if not module_name:
+            raise ValueError("source '{}' should look like python:module.func".format(spec))
+        try:
+            return getattr(importlib.import_module(module_name), func_name)
+        except Exception as e:
+            # importing runs the module, which can fail in any way
+            raise ValueError("can't load source '{}': {}: {}".format(spec, type(e).__name__, e))
+    if spec in _per_box:
+        return _per_box[spec]()
+    if spec in builtin:
+        return builtin[spec]
+    entry_point = _entry_points().get(spec)
+    if entry_point is not None:
+        try:
+            return entry_point.load()
+        except Exception as e:
+            raise ValueError("can't load source '{}': {}: {}".format(spec, type(e).__name__, e))
+    raise ValueError("unknown source '{}', expected python:module.func or one of: {}".format(
+        spec, ', '.join(sorted(set(builtin) | set(_entry_points())))))
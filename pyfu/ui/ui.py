@@ -1,12 +1,37 @@
-import termbox as Termbox
 import subprocess
 import threading
 import _thread
 import os
 import datetime
 import time
+import selectors
+import collections
+import codecs
+import hashlib
+import shutil
+import sys
 from sys import exit
 
+try:
+    import termbox as Termbox
+except ImportError:
+    # only Dashboard.run needs a real terminal, headless rendering works without termbox.
+    Termbox = None
+
+from pyfu.ui.screen import Screen
+from pyfu.ui.layout import Layout
+from pyfu.ui.metrics import Metrics
+from pyfu.ui.shellpool import ShellPool
+from pyfu.ui import sources, config
+from pyfu.ui.resultcache import ResultCache, DEFAULT_DIR
+from pyfu.ui.filters import compile_filter
+from pyfu.ui.wrap import wrap
+from pyfu.ui import ansi
+from pyfu.ui.collector import RemoteScheduler, config_digest, connect, socket_path
+from pyfu.ui.recorder import Recorder, ReplayScheduler
+from pyfu.ui.series import Series
+from pyfu.ui.scheduler import ThreadScheduler, AsyncScheduler, SingleFlight, kill_process_group, PRIORITY_FOCUSED, PRIORITY_VISIBLE, PRIORITY_BACKGROUND
+
 # synchronized across ALL instances of a class.
 # http://theorangeduck.com/page/synchronized-python
 def synchronized(func):
@@ -39,6 +64,10 @@ def is_number(s):
         return False
 
 
+def output_digest(contents):
+    return hashlib.sha1(contents.encode('utf8')).digest()
+
+
 class Color(object):
     DEFAULT = 234
     BLACK = 16
@@ -84,6 +113,9 @@ class Color(object):
 
 
 class Box(object):
+    # lines kept beyond what the box shows
+    SCROLLBACK = 1000
+
     def __init__(
             self,
             termbox,
@@ -118,15 +150,50 @@ class Box(object):
         self.row_char = ord('─')
         self.intersection_char = ord('┼')
         self.blank_char = ord(' ')
-        self.contents = ''
+        self.lines = collections.deque([''])
         self.refresh_cmd = 'echo "hello world"'
         self.refresh_rate = 0
         self.header = None
         self.status = None
         self.id = None
         self.last_content_row = 0
+        self.content_rows = 0
         self.row_index = 0
-        self.cache_filename = None
+        self.filter = None
+        self.source = None
+        self.source_args = {}
+        self.min_rate = 0
+        self.max_rate = 0
+        self.output_digest = None
+        # floating boxes (like the metrics overlay) sit on top of the layout instead of in it
+        self.floating = False
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.height = None
+        self.stream = False
+        self.decoder = None
+        self.stream_pending = False
+        self.stream_flushed = 0
+        self.stream_started = None
+        self.streaming = False
+        self.timeout = 0
+        # the box's yaml properties, compared on config reload
+        self.props = None
+        self.max_lines = None
+        self.stopped = False
+        # goes up on resume, so timers and queued runs from before a stop stay cancelled
+        self.generation = 0
+        # index of the first line shown, and a list copy of lines for jumping straight to it
+        self.scroll = 0
+        self.line_index = None
+        # samples of a `type: series` box
+        self.series = None
+        # wrapped rows of each line, kept until the contents change.  The previous
+        # generation is kept too, so lines that survive a refresh aren't wrapped again.
+        self.version = 0
+        self.wrap_key = None
+        self.wrapped = {}
+        self.previous_wrapped = {}
 
     def draw(self):
         self.draw_borders()
@@ -141,12 +208,146 @@ class Box(object):
         self.intersection_char = self.blank_char
 
     def redraw(self):
-        self.row = self.dashboard.get_starting_row(self.row_index)
+        if not self.floating:
+            self.row = self.dashboard.get_starting_row(self.row_index)
         self.rewrite()
         self.redraw_border()
 
+    # lines are changed by refresh and stream threads while the render thread
+    # paints them, so both sides hold the dashboard's render_lock.
+
+    @property
+    def contents(self):
+        with self.dashboard.render_lock:
+            return '\n'.join(self.lines)
+
+    @contents.setter
+    def contents(self, contents):
+        # a replaced output keeps its head, since that is what the box shows.
+        lines = contents.split('\n')
+        if self.lines.maxlen is not None:
+            del lines[self.lines.maxlen:]
+        with self.dashboard.render_lock:
+            self.lines = collections.deque(lines, self.lines.maxlen)
+            self.output_digest = None
+            self._contents_changed()
+
+    def set_max_lines(self, max_lines):
+        with self.dashboard.render_lock:
+            self.lines = collections.deque(self.lines, max_lines)
+            self._contents_changed()
+
+    def _contents_changed(self):
+        self.line_index = None
+        self.version += 1
+
+    def line_limit(self):
+        """How many lines the box keeps: stream-lines or max-lines if set, else its height plus scrollback."""
+        if self.stream:
+            return self.max_lines or self.height
+        return self.max_lines or self.height + Box.SCROLLBACK
+
+    def extend(self, contents):
+        """Adds text to the end of the contents without repainting.  Costs O(len(contents))."""
+        new_lines = contents.split('\n')
+        with self.dashboard.render_lock:
+            self.lines[-1] += new_lines[0]
+            # the deque drops the oldest lines once it is full
+            self.lines.extend(new_lines[1:])
+            self.output_digest = None
+            self._contents_changed()
+
+    def memory_usage(self):
+        """Approximate bytes held by the box contents, and its samples if it is a series."""
+        with self.dashboard.render_lock:
+            size = sys.getsizeof(self.lines) + sum(sys.getsizeof(line) for line in self.lines)
+        if self.series:
+            size += self.series.memory_usage()
+        return size
+
     def rewrite(self):
-        self.write(self.contents)
+        height = self.calc_height()
+        self._clear_cells()
+        self._write_header()
+        self._paint_lines()
+        self.content_rows = self.last_content_row - self.row
+        if self.calc_height() != height and not self.floating:
+            self.dashboard.box_resized(self)
+
+    def visible_rows(self):
+        """Content rows the box can show: its height less the borders, or down to end_row if it has none."""
+        if self.height is None:
+            return self.end_row - self.row - 1
+        return max(1, self.height - 2)
+
+    def _visible_lines(self):
+        """Yields the lines from the scroll position on.  Costs the same at line 80,000 as at line 0."""
+        if not self.scroll:
+            # the head of the deque needs no index
+            yield from self.lines
+            return
+        if self.line_index is None:
+            # built once per content change, scrolling just indexes into it.
+            self.line_index = list(self.lines)
+        for i in range(min(self.scroll, len(self.line_index) - 1), len(self.line_index)):
+            yield self.line_index[i]
+
+    def scroll_to(self, line):
+        line = max(0, min(line, len(self.lines) - 1))
+        if line != self.scroll:
+            self.scroll = line
+            self.dashboard.mark_dirty(self)
+
+    def scroll_by(self, lines):
+        self.scroll_to(self.scroll + lines)
+
+    def _wrap(self, line, width):
+        """Returns the cell runs of a line: one (cells, used) per row, cells being (column, (ch, fg, bg))."""
+        rows = self.wrapped.get(line)
+        if rows is None:
+            rows = self.previous_wrapped.get(line)
+            if rows is None:
+                # escape sequences are parsed here, once per line per content change.
+                rows = wrap(ansi.parse(line, self.fg, self.bg), width, self.allow_wrap)
+            self.wrapped[line] = rows
+        return rows
+
+    def _change_cells(self, cells):
+        change_cells = getattr(self.termbox, 'change_cells', None)
+        if change_cells:
+            change_cells(cells)
+            return
+        for (x, y), (ch, fg, bg) in cells:
+            self.termbox.change_cell(x, y, ch, fg, bg)
+
+    def _paint_lines(self):
+        width = max(1, self.end_col - self.col - 1)
+        # lines are wrapped once per content change, repaints only replay the cached runs.
+        key = (self.version, width, self.allow_wrap, self.fg, self.bg)
+        if key != self.wrap_key:
+            same_shape = self.wrap_key is not None and self.wrap_key[1:] == key[1:]
+            self.previous_wrapped = self.wrapped if same_shape else {}
+            self.wrapped = {}
+            self.wrap_key = key
+        bottom = min(self.end_row, self.row + 1 + self.visible_rows())
+        left = self.col + 1
+        row = self.row + 1
+        self.last_content_row = row
+        painted = []
+        for line in self._visible_lines():
+            for cells, used in self._wrap(line, width):
+                if row >= bottom:
+                    break
+                self.last_content_row = row
+                painted.extend(((left + col, row), cell) for col, cell in cells)
+                if self.floating:
+                    # nothing clears the cells under a floating box, so it paints its own background.
+                    blank = (self.blank_char, self.fg, self.bg)
+                    painted.extend(((col, row), blank) for col in range(left + used, left + width))
+                row += 1
+            if row >= bottom:
+                break
+        self._change_cells(painted)
 
     def redraw_border(self):
         self.draw_borders()
@@ -156,30 +357,24 @@ class Box(object):
     def reset_border(self):
         self.border_fg = self.orig_border_fg
         self.border_bg = self.orig_border_bg
-        self.redraw_border()
 
     def hilight_border(self):
-        old_fg = self.border_fg
-        old_bg = self.border_bg
-        self.border_fg = self.border_bg
-        self.border_bg = old_fg
-        self.draw_borders()
-        self.write_status(self.status)
-
-        # switch colors back to original to write the header, then switch back to highlighted colors
-        self.border_fg = self.orig_border_fg
-        self.border_bg = self.orig_border_bg
-        self._write_header()
-        self.border_fg = old_bg
-        self.border_bg = old_fg
+        # the next repaint draws the border in inverted colors; the header keeps the original ones.
+        # set rather than swapped, so highlighting a box that already is one leaves it highlighted.
+        self.border_fg = self.orig_border_bg
+        self.border_bg = self.orig_border_fg
 
     def append(self, contents):
-        self.write(self.contents + contents)
+        self.extend(contents)
+        self.rewrite()
 
     def _write_header(self):
         i = 0
-        if self.header:
-            hdr = '  ' + self.header + '  '
+        header = self.header
+        if self.scroll:
+            header = '{} - line {}/{}'.format(header or '', self.scroll + 1, len(self.lines)).lstrip(' -')
+        if header:
+            hdr = '  ' + header + '  '
             for col in range(self.col + 2, self.end_col):
                 self.termbox.change_cell(col, self.row, ord(hdr[i]), self.orig_border_bg, self.orig_border_fg)
                 i += 1
@@ -187,28 +382,8 @@ class Box(object):
                     return
 
     def write(self, contents):
-        self.clear()
         self.contents = contents
-        i = 0
-        j = self.row + 1
-        just_encountered_newline = False
-        self._write_header()
-        for row in range(j, self.end_row):
-            self.last_content_row = row
-            if i >= len(self.contents):
-                return
-            if not self.allow_wrap and not just_encountered_newline and i > 0:
-                return
-            for col in range(self.col + 1, self.end_col):
-                if self.contents[i] == '\n':
-                    just_encountered_newline = True
-                    i += 1
-                    break
-                just_encountered_newline = False
-                self.termbox.change_cell(col, row, ord(self.contents[i]), self.fg, self.bg)
-                i += 1
-                if i >= len(self.contents):
-                    return
+        self.rewrite()
 
     def write_status(self, status):
         self.status = status
@@ -221,11 +396,17 @@ class Box(object):
             if i >= len(self.status):
                 return
 
+    def redraw_status(self):
+        bottom = self.calc_dyn_bottom_border_row()
+        for col in range(self.col + 1, self.end_col):
+            self.termbox.change_cell(col, bottom, self.row_char, self.border_fg, self.border_bg)
+        self.write_status(self.status)
+
     def calc_dyn_bottom_border_row(self):
         if self.last_content_row == 0:
             return self.row
         else:
-            return self.last_content_row + 1
+            return self.row + self.content_rows + 1
 
     def calc_height(self):
         return self.calc_dyn_bottom_border_row() - self.row + 1
@@ -249,69 +430,256 @@ class Box(object):
 
     def clear(self):
         self.contents = ''
-        for row in range(self.row + 1, self.calc_dyn_bottom_border_row()):
-            for col in range(self.col + 1, self.end_col):
-                self.termbox.change_cell(col, row, self.blank_char, self.fg, self.bg)
+        self._clear_cells()
         self._write_header()
 
+    def _clear_cells(self):
+        blank = (self.blank_char, self.fg, self.bg)
+        self._change_cells([((col, row), blank)
+                            for row in range(self.row + 1, self.calc_dyn_bottom_border_row())
+                            for col in range(self.col + 1, self.end_col)])
+
     def refresh(self, use_cache=False):
+        if use_cache and self.show_cached():
+            return
         before = datetime.datetime.now()
+        self.show_result(self.run_cmd(), before)
+
+    def show_result(self, contents, before, queue_wait=0, shared=False):
+        """Shows a finished run of the command.  contents is None if it timed out."""
+        if contents is None:
+            self.show_timeout()
+            return
+        digest = output_digest(contents)
+        if not shared:
+            if digest == self.output_digest:
+                # same output as last time: keep the cache file, just mark it fresh.
+                self.dashboard.cache.touch(self.refresh_cmd)
+            else:
+                self.dashboard.cache.put(self.refresh_cmd, contents)
+        self.show(contents, before, queue_wait=queue_wait, shared=shared, digest=digest)
 
-        if use_cache:
-            contents = [line.rstrip('\n') for line in open(self._cache_filename())]
-            contents = '\n'.join(contents)
+    def flight_key(self):
+        # boxes running the same command with the same timeout can share one run.
+        return self.refresh_cmd, self.timeout
+
+    def run_cmd(self):
+        """Returns the command's output, or None if it ran longer than the box's timeout."""
+        if self.source:
+            return self.run_source()
+        if self.dashboard.shells:
+            return self.dashboard.shells.run(self.refresh_cmd, self.timeout or None)
+        process = subprocess.Popen(
+            self.refresh_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            shell=True,
+            start_new_session=self.timeout > 0
+        )
+        try:
+            stdout, _ = process.communicate(timeout=self.timeout or None)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process.pid)
+            process.communicate()
+            return None
+        return stdout.decode('utf8', 'replace').strip()
+
+    def run_source(self):
+        """Calls the box's Python source in the current thread and returns its text."""
+        try:
+            result = self.source(**self.source_args)
+        except Exception as e:
+            return 'error: {}: {}'.format(type(e).__name__, e)
+        if isinstance(result, (list, tuple)):
+            result = '\n'.join(str(line) for line in result)
+        return str(result).strip()
+
+    def show_timeout(self):
+        if self.stopped:
+            return
+        self.dashboard.metrics.record_refresh(self, self.timeout, 0, 0, 'timeout')
+        # the previous output stays up, only the status line changes.
+        now = datetime.datetime.now().strftime('%H:%M:%S')
+        self.status = '{} - timed out after {:g}s - next in {:g}'.format(now, self.timeout, self.refresh_rate)
+        self.dashboard.mark_dirty(self, status_only=True)
+
+    def show(self, contents, before, cached=False, queue_wait=0, mtime=None, shared=False, digest=None):
+        if self.stopped:
+            # removed from the dashboard by a config reload while its command was running.
+            return
+        now = datetime.datetime.now()
+        if mtime is not None:
+            now = datetime.datetime.fromtimestamp(mtime)
+        took = 0 if cached else (now - before).total_seconds()
+        how = 'cached' if cached else 'shared' if shared else 'ran'
+        data = contents.encode('utf8')
+        self.dashboard.metrics.record_refresh(self, took, queue_wait, len(data), how)
+        if digest is None:
+            digest = hashlib.sha1(data).digest()
+        changed = digest != self.output_digest
+        self.adapt_rate(changed, took)
+        if self.series:
+            # every refresh is a sample, even one that repeats the last.
+            self.series.add(self.filter(contents) if self.filter else contents)
+            self.contents = self.series.render(self.end_col - self.col - 1)
+            self.output_digest = digest
+            changed = True
+        elif changed:
+            # only the render loop paints, this just hands it the new lines.
+            self.contents = self.filter(contents) if self.filter else contents
+            self.output_digest = digest
+        status = [now.strftime('%H:%M:%S')]
+        if cached:
+            status.append('cached')
+        elif shared:
+            status.append('shared, took {}'.format(round(took, 1)))
+        else:
+            status.append('took {}'.format(round(took, 1)))
+        if queue_wait >= 0.1:
+            status.append('queued {} ({} waiting)'.format(round(queue_wait, 1), self.dashboard.scheduler.queue_depth()))
+        if self.cache_hits or self.cache_misses:
+            status.append('cache {}/{}'.format(self.cache_hits, self.cache_hits + self.cache_misses))
+        if self.max_rate:
+            status.append('next in {} (adaptive)'.format(round(self.refresh_rate, 1)))
         else:
-            contents = subprocess.Popen(
+            status.append('next in {:g}'.format(self.refresh_rate))
+        self.status = ' - '.join(status)
+        # unchanged output only needs its status line repainted.
+        self.dashboard.mark_dirty(self, status_only=not changed)
+
+    def adapt_rate(self, changed, took):
+        """
+        With min-rate-sec/max-rate-sec set, the refresh interval doubles while the output stays
+        the same or the command takes more than half the interval, and drops back to the minimum
+        as soon as the output changes.
+        """
+        if not self.max_rate:
+            return
+        slow = took > self.refresh_rate / 2.0
+        if changed and not slow:
+            rate = self.min_rate
+        else:
+            rate = self.refresh_rate * 2
+        self.refresh_rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def show_cached(self):
+        """Shows the output of the same command if any dashboard on the host ran it within the refresh interval."""
+        if self.refresh_rate <= 0 or self.stream:
+            return False
+        entry = self.dashboard.cache.get(self.refresh_cmd, self.refresh_rate)
+        if entry is None:
+            self.cache_misses += 1
+            return False
+        self.cache_hits += 1
+        self.show(entry.contents, None, cached=True, mtime=entry.mtime)
+        return True
+
+    def stream_output(self):
+        """Runs the command and shows its output line by line as it arrives, until it exits."""
+        if self.streaming:
+            return
+        self.streaming = True
+        try:
+            process = subprocess.Popen(
                 self.refresh_cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                shell=True
-            ).stdout.read().decode('utf8').strip()
-
-            # write to file, for caching
-            output = open(self._cache_filename(), 'w')
-            output.write(contents)
-            output.close()
-
-        mtime = datetime.datetime.fromtimestamp(os.path.getmtime(self._cache_filename()))
-        self.write(contents)
-        if use_cache:
-            self.write_status('{} - cached - next in {}'.format(mtime.strftime('%H:%M:%S'), self.refresh_rate))
-        else:
-            took = str(round((mtime - before).total_seconds(), 1))
-            self.write_status('{} - took {} - next in {}'.format(mtime.strftime('%H:%M:%S'), took, self.refresh_rate))
-        self.dashboard.redraw(self.termbox)
-
-    def _refresh_and_reschedule(self):
-        do_cache = False
-        if self.refresh_rate > 0:
-            if os.path.isfile(self._cache_filename()):
-                mtime = os.path.getmtime(self._cache_filename())
-                do_cache = mtime > (time.time() - self.refresh_rate + 5) # the +5sec is to make sure the comparison doesn't fail if there's any tiny time comparison issues.
-        self.refresh(use_cache=do_cache)
-        if self.refresh_rate > 0:
-            thread = threading.Timer(self.refresh_rate, self._refresh_and_reschedule)
+                shell=True,
+                start_new_session=True
+            )
+            fd = process.stdout.fileno()
+            os.set_blocking(fd, False)
+            selector = selectors.DefaultSelector()
+            selector.register(fd, selectors.EVENT_READ)
+            self.start_stream()
+            try:
+                while True:
+                    if self.stopped:
+                        kill_process_group(process.pid)
+                        break
+                    if selector.select(timeout=self.dashboard.poll_time()):
+                        chunk = os.read(fd, 65536)
+                        if not chunk:
+                            break
+                        self.feed(chunk)
+                    self.flush_stream()
+            finally:
+                selector.close()
+                process.stdout.close()
+            self.end_stream(process.wait())
+        finally:
+            # also when stopped, so a resumed box can start streaming again.
+            self.streaming = False
+
+    def start_stream(self):
+        self.streaming = True
+        self.contents = ''
+        self.decoder = codecs.getincrementaldecoder('utf8')('replace')
+        self.stream_pending = False
+        self.stream_flushed = 0
+        self.stream_started = datetime.datetime.now()
+
+    def feed(self, chunk):
+        self.extend(self.decoder.decode(chunk))
+        self.stream_pending = True
+
+    def flush_stream(self, force=False):
+        # output is written at most once per frame, however fast lines arrive.
+        if self.stopped or (not self.stream_pending and not force):
+            return
+        if not force and time.time() - self.stream_flushed < self.dashboard.frame_time():
+            return
+        self.status = '{} - streaming - {} lines'.format(datetime.datetime.now().strftime('%H:%M:%S'), len(self.lines))
+        self.stream_pending = False
+        self.stream_flushed = time.time()
+        self.dashboard.mark_dirty(self)
+
+    def end_stream(self, returncode):
+        if self.stopped:
+            return
+        self.extend(self.decoder.decode(b'', final=True))
+        self.flush_stream(force=True)
+        now = datetime.datetime.now()
+        took = round((now - self.stream_started).total_seconds(), 1)
+        self.status = '{} - exited {} after {} - next in {:g}'.format(now.strftime('%H:%M:%S'), returncode, took, self.refresh_rate)
+        self.dashboard.mark_dirty(self)
+
+    def _refresh_and_reschedule(self, generation):
+        if self.stopped or generation != self.generation:
+            return
+        self.dashboard.scheduler.run(self, use_cache=True)
+        if self.refresh_rate > 0 and not self.stopped:
+            thread = threading.Timer(self.refresh_rate, self._refresh_and_reschedule, (generation,))
             thread.start()
             thread.join()
 
     def start_refreshing(self):
-        _thread.start_new_thread(self._refresh_and_reschedule, ())
+        _thread.start_new_thread(self._refresh_and_reschedule, (self.generation,))
 
-    def _cache_filename(self):
-        if not self.cache_filename:
-            self.cache_filename = '/tmp/dashboard_' + self.id
-        return self.cache_filename
+    def stop(self):
+        """Stops refreshing.  A command already running finishes but its output is dropped."""
+        self.stopped = True
 
+    def resume(self):
+        """Allows refreshing again after stop.  The scheduler has to be told to start it."""
+        self.stopped = False
+        self.generation += 1
 
 class Dashboard(object):
-    def __init__(self, properties, name):
+    # box options that change what a box runs, or when.  Changing any other option restyles the box in place.
+    RESTART_KEYS = ('cmd', 'source', 'source-args', 'filter', 'timeout-sec', 'stream', 'stream-lines',
+                    'rate-sec', 'min-rate-sec', 'max-rate-sec', 'type', 'samples')
+    # how long a stream waits for output before checking its box, when fps doesn't say
+    STREAM_POLL_SEC = 0.1
+
+    def __init__(self, properties, name, config_path=None, use_collector=True):
         self.name = name
         self.properties = properties
+        self.config_path = config_path
         self.auto_size = False
         if self.properties['width'] and str(self.properties['height']) == 'auto':
-            self.max_row, self.max_col = os.popen('stty size', 'r').read().split()
-            self.max_row = int(self.max_row)
-            self.max_col = int(self.max_col)
+            # falls back to 80x24 without a terminal, e.g. in a collector.
+            self.max_col, self.max_row = shutil.get_terminal_size()
             self.auto_size = True
         else:
             self.max_col = int(self.properties['width'])
@@ -319,47 +687,297 @@ class Dashboard(object):
         self.current_col = 0
         self.boxes = []
         self.current_box = -1
+        # while True, j/k scroll the selected box instead of selecting another one
+        self.scrolling = False
+        # False while another dashboard has the terminal, see run_tabs
+        self.visible = True
         self.row_heights = []
+        self.screen = None
+        self.fps = float(self.properties.get('fps', 30))
+        self.render_cond = threading.Condition()
+        self.render_lock = threading.RLock()
+        self.dirty_boxes = set()
+        self.status_boxes = set()
+        self.full_redraw = False
+        self.layout = Layout()
+        self.metrics = Metrics(self.name, self.properties.get('metrics-file'))
+        self.overlay = None
+        self.notice = None
+        self.flights = SingleFlight()
+        shell_pool = int(self.properties.get('shell-pool', 0))
+        self.shells = ShellPool(shell_pool) if shell_pool > 0 else None
+        self.cache = ResultCache(self.properties.get('cache-dir', DEFAULT_DIR))
+        self.drawn_layout = None
+        # called with (box, status_only) whenever a box has new output or status
+        self.listeners = []
+        self.recorder = None
+        collector = None
+        if use_collector:
+            collector = connect(socket_path(self.properties, self.name), config_digest(self.properties))
+        if collector:
+            # a `dashboard --serve` collector runs the commands, this process only renders.
+            self.scheduler = RemoteScheduler(self, collector)
+        else:
+            self.scheduler = self._local_scheduler()
+
+    def _local_scheduler(self):
+        max_concurrency = int(self.properties.get('max-concurrency', 0))
+        if self.properties.get('scheduler', 'threads') == 'asyncio':
+            return AsyncScheduler(self, max_concurrency)
+        return ThreadScheduler(self, max_concurrency)
+
+    def collector_lost(self):
+        """Runs the commands locally from now on, after the collector this dashboard watched went away."""
+        self.scheduler = self._local_scheduler()
+        self.scheduler.start()
+        self._start_recording()
+
+    def _start_recording(self):
+        # only the process that runs the commands records, not collector clients or a replay.
+        if not self.properties.get('record-dir') or self.recorder:
+            return
+        if isinstance(self.scheduler, (RemoteScheduler, ReplayScheduler)):
+            return
+        try:
+            self.recorder = Recorder(os.path.expanduser(self.properties['record-dir']), self.name)
+        except OSError:
+            # another dashboard on this host is already recording it
+            return
+        self.listeners.append(self.recorder.record)
+
+    def cells_touched(self):
+        """Number of cells sent to termbox by the last frame."""
+        if not self.screen:
+            return 0
+        return self.screen.cells_touched
 
-    @synchronized_method
     def redraw(self, termbox):
-        termbox.clear()
+        with self.render_lock:
+            if not self.visible:
+                return
+            termbox.clear()
+            for box in self.boxes:
+                self._redraw_box(box)
+            self._redraw_overlay()
+            self.drawn_layout = self.layout.version
+            termbox.present()
+
+    def _redraw_box(self, box):
+        started = time.time()
+        box.redraw()
+        self.metrics.record_render(box, time.time() - started)
+
+    def _redraw_overlay(self):
+        if self.overlay:
+            memory = {box.id: box.memory_usage() for box in self.boxes}
+            self.overlay.contents = '{} cells sent last frame\n{}'.format(self.cells_touched(), self.metrics.report(memory))
+            self.overlay.redraw()
+        if self.notice:
+            self.notice.redraw()
+
+    def toggle_overlay(self, termbox):
+        """Shows or hides a box with per-box timing statistics on top of the dashboard."""
+        if self.overlay:
+            self.overlay = None
+        else:
+            self.overlay = Box(termbox, self, col=0, end_col=min(self.max_col - 1, 90), border_fg=Color.YELLOW)
+            self.overlay.header = 'metrics (i to close)'
+            self.overlay.floating = True
+        self.mark_dirty()
+
+    def show_notice(self, message, header='config not reloaded', color=Color.RED):
+        """Shows a message on top of the dashboard until it is called again with None."""
+        if message is None:
+            if self.notice:
+                self.notice = None
+                self.mark_dirty()
+            return
+        self.notice = Box(self.screen, self, col=0, end_col=min(self.max_col - 1, 100), border_fg=color)
+        self.notice.header = header
+        self.notice.floating = True
+        self.notice.contents = message
+        self.mark_dirty()
+
+    def frame_time(self):
+        return 1.0 / self.fps if self.fps > 0 else 0
+
+    def poll_time(self):
+        # once a frame, but never 0: that would spin a stream waiting for output.
+        return self.frame_time() or Dashboard.STREAM_POLL_SEC
+
+    def mark_dirty(self, box=None, status_only=False):
+        """Asks the render loop to repaint a box (or just its status line), or the whole screen if no box is given."""
+        with self.render_cond:
+            if box is None:
+                self.full_redraw = True
+            elif status_only:
+                self.status_boxes.add(box)
+            else:
+                self.dirty_boxes.add(box)
+            self.render_cond.notify()
+        if box is not None:
+            for listener in self.listeners:
+                listener(box, status_only)
+
+    def take_dirty(self, wait=False):
+        """Returns and resets (dirty boxes, status-only boxes, full redraw), optionally waiting for any."""
+        with self.render_cond:
+            while wait and not self.dirty_boxes and not self.status_boxes and not self.full_redraw:
+                self.render_cond.wait()
+            dirty = (self.dirty_boxes, self.status_boxes, self.full_redraw)
+            self.dirty_boxes = set()
+            self.status_boxes = set()
+            self.full_redraw = False
+            return dirty
+
+    def render(self, termbox, dirty, full=False, status=()):
+        with self.render_lock:
+            if not self.visible:
+                return
+            if not full and self.drawn_layout == self.layout.version:
+                for box in self.boxes:
+                    if box in dirty:
+                        self._redraw_box(box)
+                    elif box in status:
+                        box.redraw_status()
+                self._redraw_overlay()
+            # a box that changed height while repainting moves the boxes below it.
+            if full or self.drawn_layout != self.layout.version:
+                self.redraw(termbox)
+                return
+            termbox.present()
+
+    def box_resized(self, box):
+        with self.render_lock:
+            self.layout.box_resized(box)
+
+    def resize(self, width, height):
+        """Re-fits auto-sized boxes to a new terminal size."""
+        with self.render_lock:
+            if not self.auto_size or (width, height) == (self.max_col, self.max_row):
+                return
+            self.max_col = width
+            self.max_row = height
+            self._relayout()
+
+    def _relayout(self):
+        self.current_col = 0
+        self.row_heights = []
+        self.layout.clear()
         for box in self.boxes:
-            box.redraw()
-        termbox.present()
+            width, height = self._get_width_height(box.props, len(self.boxes))
+            self._place(box, width, height)
+            self.layout.add(box)
 
-    def add_box(self, termbox, width, height):
+    def reload(self, properties):
+        """
+        Switches to new properties for this dashboard.  Boxes are matched by id: added boxes
+        start, removed boxes stop, boxes whose command changed are replaced, and boxes with only
+        cosmetic changes keep their output and schedule.  Everything is laid out again.
+        """
+        old = {box.id: box for box in self.boxes}
+        boxes = []
+        started = []
+        # build every new box before touching the running ones, so a bad source leaves the dashboard as it was.
+        for box_props in properties['boxes']:
+            box = old.pop('{}'.format(box_props['id']), None)
+            if box is None or any(box.props.get(key) != box_props.get(key) for key in Dashboard.RESTART_KEYS):
+                box = self.build_box(self.screen, box_props)
+                started.append(box)
+            boxes.append((box, box_props))
+        # every running box that didn't make it into the new list, even one that shared its id with another.
+        kept = set(box for box, _ in boxes)
+        stopped = [box for box in self.boxes if box not in kept]
+        with self.render_lock:
+            for box in stopped:
+                box.stop()
+            for box, box_props in boxes:
+                if box.props != box_props:
+                    self._style_box(box, box_props)
+            self.properties = properties
+            self.boxes = [box for box, _ in boxes]
+            self.current_box = -1
+            self.scrolling = False
+            self._relayout()
+        for box in started:
+            if self.visible:
+                self.scheduler.add(box)
+            else:
+                box.stop()
+        self.mark_dirty()
+
+    def _config_changed(self):
+        try:
+            properties = config.load(self.config_path)
+            matches = [d for d in properties['dashboards'] if d['name'] == self.name]
+            if not matches:
+                raise config.ConfigError("dashboard '{}' is no longer in {}".format(self.name, self.config_path))
+            self.reload(matches[0])
+        except (config.ConfigError, OSError, ValueError) as e:
+            # keep running the boxes we have until the file is fixed.
+            self.show_notice(str(e))
+            return
+        self.show_notice(None)
+
+    def _render_loop(self, termbox):
+        # Presents at most once per tick, no matter how many boxes became dirty in between.
+        tick = self.frame_time()
+        while True:
+            dirty, status, full = self.take_dirty(wait=True)
+            started = time.time()
+            try:
+                self.render(termbox, dirty, full, status)
+            except Exception as e:
+                # a bad frame mustn't stop the dashboard from ever repainting again.
+                self.show_notice('{}: {}'.format(type(e).__name__, e), header='render failed')
+            elapsed = time.time() - started
+            if elapsed < tick:
+                time.sleep(tick - elapsed)
+
+    def start_rendering(self, termbox):
+        thread = threading.Thread(target=self._render_loop, args=(termbox,), daemon=True)
+        thread.start()
+
+    def add_box(self, termbox, width, height, box=None):
         if width > self.max_col:
             raise Exception("width of box ({width}) cannot be wider than max_row: {self.max_row}".format(**locals()))
         if height > self.max_row:
             raise Exception("height of box ({height}) cannot be higher than max_col: {self.max_col}".format(**locals()))
+        if box is None:
+            box = Box(termbox, self)
+        self._place(box, width, height)
+        self.boxes.append(box)
+        self.layout.add(box)
+        return box
+
+    def _place(self, box, width, height):
         if not self.row_heights:
             self.row_heights.append(height)
         if self.current_col + width > self.max_col:
             self.row_heights.append(height)
             self.current_col = 0
-        box = Box(termbox, self, col=self.current_col, end_col=self.current_col + width - 1)
+        box.col = self.current_col - 1 if self.current_col > 1 else self.current_col
+        box.end_col = self.current_col + width - 1
         box.row_index = len(self.row_heights) - 1
+        box.height = height
+        box.set_max_lines(box.line_limit())
         self.current_col += width + 1
-        self.boxes.append(box)
-        return box
 
     def row_height(self, row_index):
-        max = 0
-        for box in self.boxes:
-            if box.row_index == row_index:
-                height = box.calc_height()
-                if height > max:
-                    max = height
-        return max
+        return self.layout.row_height(row_index)
 
     def get_starting_row(self, row_index):
-        if row_index == 0:
-            return 0
-        starting_row = 0
-        for i in range(0, row_index):
-            starting_row += self.row_height(i)
-        return starting_row
+        return self.layout.starting_row(row_index)
+
+    def priority(self, box):
+        """The focused box runs first, then boxes on screen, then boxes below the bottom edge."""
+        # scheduler threads call this while the render thread may be rebuilding the layout's row offsets.
+        with self.render_lock:
+            if self.current_box != -1 and self.boxes[self.current_box] is box:
+                return PRIORITY_FOCUSED
+            if self.get_starting_row(box.row_index) < self.max_row:
+                return PRIORITY_VISIBLE
+            return PRIORITY_BACKGROUND
 
     def current(self):
         if self.current_box == -1:
@@ -393,72 +1011,202 @@ class Dashboard(object):
         else:
             return int(box_props['width']), int(box_props['height'])
 
+    def build_box(self, termbox, box_props):
+        """Returns a new box set up from its yaml properties, not yet placed on the dashboard."""
+        box = Box(termbox, self)
+        box.props = box_props
+        box.id = '{}'.format(box_props['id'])
+        if 'source' in box_props:
+            box.source = sources.resolve(box_props['source'])
+            box.source_args = box_props.get('source-args', {})
+            # refresh_cmd keys the shared cache and in-flight dedupe, so it names the source and its
+            # arguments in a form no shell command takes: source: uptime and cmd: uptime differ.
+            box.refresh_cmd = 'source:{}{!r}'.format(box_props['source'], sorted(box.source_args.items()))
+        else:
+            box.refresh_cmd = box_props['cmd']
+        if 'rate-sec' in box_props:
+            box.refresh_rate = float(box_props['rate-sec'])
+        if 'min-rate-sec' in box_props or 'max-rate-sec' in box_props:
+            box.min_rate = float(box_props.get('min-rate-sec', box.refresh_rate or 1))
+            box.max_rate = float(box_props.get('max-rate-sec', box.min_rate * 10))
+            box.refresh_rate = box.min_rate
+        if 'filter' in box_props:
+            box.filter = compile_filter(box_props['filter'])
+        if 'timeout-sec' in box_props:
+            box.timeout = float(box_props['timeout-sec'])
+        if box_props.get('stream'):
+            box.stream = True
+        if box_props.get('type') == 'series':
+            box.series = Series(int(box_props.get('samples', 1000)))
+        self._style_box(box, box_props)
+        return box
+
+    def _style_box(self, box, box_props):
+        """Applies the options that don't change what the box runs."""
+        box.props = box_props
+        box.header = box_props.get('name')
+        if box.series:
+            box.series.names = box_props.get('series-names', [])
+        if box.stream:
+            box.max_lines = box_props.get('stream-lines')
+        else:
+            box.max_lines = box_props.get('max-lines')
+        box.border_fg = box.orig_border_fg = Color.from_string(box_props.get('color-border-fg', Color.WHITE))
+        box.border_bg = box.orig_border_bg = Color.from_string(box_props.get('color-border-bg', Color.DEFAULT))
+        box.fg = Color.from_string(box_props.get('color-content-fg', Color.WHITE))
+        box.bg = Color.from_string(box_props.get('color-content-bg', Color.DEFAULT))
+
+    def start(self, termbox, paused=False):
+        """Adds the configured boxes and starts refreshing them, unless paused."""
+        self.screen = termbox
+        self.visible = not paused
+        for box_props in self.properties['boxes']:
+            width, height = self._get_width_height(box_props, len(self.properties['boxes']))
+            box = self.add_box(termbox, width, height, self.build_box(termbox, box_props))
+            if paused:
+                box.stop()
+
+        # With the thread scheduler each box gets its own refresh thread,
+        # with the asyncio scheduler all boxes share one event loop thread.
+        self.scheduler.start()
+        self._start_recording()
+        if self.config_path:
+            config.watch(self.config_path, self._config_changed, on_error=lambda e: self.show_notice(
+                '{}: {}'.format(type(e).__name__, e), header='config reload failed'))
+
+    def pause(self):
+        """Stops drawing and refreshing while another dashboard has the terminal.  Boxes keep their output."""
+        with self.render_lock:
+            self.visible = False
+        for box in self.boxes:
+            box.stop()
+
+    def resume(self):
+        """Redraws the last output straight away and refreshes every box."""
+        with self.render_lock:
+            self.visible = True
+        for box in self.boxes:
+            if box.contents == '' and box.refresh_rate > 0:
+                # never shown yet: start from whatever the cache has, however old.
+                entry = self.cache.get(box.refresh_cmd, float('inf'))
+                if entry is not None and not box.stream and not box.series:
+                    box.contents = box.filter(entry.contents) if box.filter else entry.contents
+            box.resume()
+            self.scheduler.add(box)
+        self.mark_dirty()
+
     def run(self):
-        with Termbox.Termbox() as termbox:
-            termbox.select_output_mode(2)
-            termbox.clear()
+        run_tabs([self])
 
-            for box_props in self.properties['boxes']:
-                width, height = self._get_width_height(box_props, len(self.properties['boxes']))
-                box = self.add_box(termbox, width, height)
-                box.id = '{}'.format(box_props['id'])
-                if 'name' in box_props:
-                    box.header = box_props['name']
-                box.refresh_cmd = box_props['cmd']
-                if 'rate-sec' in box_props:
-                    box.refresh_rate = int(box_props['rate-sec'])
-                if 'color-border-fg' in box_props:
-                    box.border_fg = Color.from_string(box_props['color-border-fg'])
-                    box.orig_border_fg = box.border_fg
-                if 'color-border-bg' in box_props:
-                    box.border_bg = Color.from_string(box_props['color-border-bg'])
-                    box.orig_border_bg = box.border_bg
-                if 'color-content-fg' in box_props:
-                    box.fg = Color.from_string(box_props['color-content-fg'])
-                if 'color-content-bg' in box_props:
-                    box.bg = Color.from_string(box_props['color-content-bg'])
-
-            # This uses a new thread to spawn all refresh threads.
-            # Each refresh thread blocks the spawn thread, instead of the main thread.
+    def handle_key(self, termbox, ch, key):
+        if key == Termbox.KEY_ESC:
+            self.scrolling = False
+            self.current().reset_border()
+        elif ch == 'R':
             for box in self.boxes:
-                box.start_refreshing()
-
-            # Now use the main thread to wait for user input of any kind.
-            while True:
-                event_here = termbox.poll_event()
-                while event_here:
-                    (type, ch, key, mod, w, h, x, y) = event_here
-                    if type == Termbox.EVENT_RESIZE:
-                        self.redraw(termbox)
-                    elif type == Termbox.EVENT_KEY:
-                        if key == Termbox.KEY_ESC:
-                            self.current().reset_border()
-                        elif key == Termbox.KEY_CTRL_C:
-                            exit(0)
-                        elif ch == 'R':
-                            for box in self.boxes:
-                                box.clear()
-                                box.write("loading...")
-                                termbox.present()
-                                _thread.start_new_thread(box.refresh, ())
-                        elif ch == 'r':
-                            box = self.current()
-                            box.clear()
-                            box.write("loading...")
-                            termbox.present()
-                            box.refresh()
-                            box.hilight_border()
-                        elif ch == 'j':
-                            self.current().reset_border()
-                            self.next().hilight_border()
-                        elif ch == 'k':
-                            self.current().reset_border()
-                            self.previous().hilight_border()
-                        elif key == Termbox.KEY_CTRL_L:
-                            self.current().reset_border()
-                            self.redraw(termbox)
-                    elif type == Termbox.EVENT_MOUSE:
-                        self.current().reset_border()
-                        exit(0)
-                    event_here = termbox.peek_event()
-                    termbox.present()
+                # a streaming box is already showing its output as it arrives.
+                if not box.stream:
+                    box.contents = "loading..."
+                    self.scheduler.refresh_now(box)
+        elif ch == 'r':
+            box = self.current()
+            if not box.stream:
+                box.contents = "loading..."
+                self.scheduler.refresh_now(box)
+            box.hilight_border()
+        elif key == Termbox.KEY_ENTER:
+            self.scrolling = not self.scrolling
+            self.current().hilight_border()
+        elif key == Termbox.KEY_PGDN:
+            box = self.current()
+            box.scroll_by(box.visible_rows())
+        elif key == Termbox.KEY_PGUP:
+            box = self.current()
+            box.scroll_by(-box.visible_rows())
+        elif self.scrolling and ch == 'j':
+            self.current().scroll_by(1)
+        elif self.scrolling and ch == 'k':
+            self.current().scroll_by(-1)
+        elif self.scrolling and ch == 'g':
+            self.current().scroll_to(0)
+        elif self.scrolling and ch == 'G':
+            box = self.current()
+            # the last page, not just the last line
+            box.scroll_to(len(box.lines) - box.visible_rows())
+        elif ch == 'j':
+            self.current().reset_border()
+            self.next().hilight_border()
+        elif ch == 'k':
+            self.current().reset_border()
+            self.previous().hilight_border()
+        elif ch == 'i':
+            self.toggle_overlay(termbox)
+        elif isinstance(self.scheduler, ReplayScheduler) and ch in (' ', '+', '-', '<', '>'):
+            replay = self.scheduler
+            {' ': replay.pause, '+': replay.faster, '-': replay.slower,
+             '<': lambda: replay.jump(-60), '>': lambda: replay.jump(60)}[ch]()
+        elif key == Termbox.KEY_CTRL_L:
+            self.current().reset_border()
+        else:
+            return
+        # keys only change state, the render loop paints it.
+        self.mark_dirty()
+
+
+def run_tabs(dashboards):
+    """
+    Shows several dashboards in one terminal, one at a time.
+
+    tab switches to the next dashboard and 1-9 to the one with that number.
+    Only the dashboard on screen runs commands: the others are paused, and
+    show their last output and refresh as soon as they are switched to.
+    """
+    if Termbox is None:
+        print("termbox is not installed: pip install termbox")
+        exit(1)
+    with Termbox.Termbox() as tb:
+        tb.select_output_mode(2)
+        tb.clear()
+        termbox = Screen(tb)
+
+        for dashboard in dashboards:
+            dashboard.start_rendering(termbox)
+            dashboard.start(termbox, paused=dashboard is not dashboards[0])
+        current = dashboards[0]
+        showing_tabs = False
+
+        # Now use the main thread to wait for user input of any kind.
+        while True:
+            event_here = termbox.poll_event()
+            while event_here:
+                (type, ch, key, mod, w, h, x, y) = event_here
+                if showing_tabs:
+                    current.show_notice(None)
+                    showing_tabs = False
+                if type == Termbox.EVENT_RESIZE:
+                    for dashboard in dashboards:
+                        dashboard.resize(w, h)
+                    with current.render_lock:
+                        termbox.invalidate()
+                    current.mark_dirty()
+                elif type == Termbox.EVENT_KEY and key == Termbox.KEY_CTRL_C:
+                    exit(0)
+                elif type == Termbox.EVENT_KEY and len(dashboards) > 1 and (
+                        key == Termbox.KEY_TAB or (ch and ch.isdigit() and 0 < int(ch) <= len(dashboards))):
+                    if key == Termbox.KEY_TAB:
+                        selected = dashboards[(dashboards.index(current) + 1) % len(dashboards)]
+                    else:
+                        selected = dashboards[int(ch) - 1]
+                    if selected is not current:
+                        current.pause()
+                        current = selected
+                        current.resume()
+                    current.show_notice('  '.join(
+                        ('[{}: {}]' if d is current else '{}: {}').format(i + 1, d.name)
+                        for i, d in enumerate(dashboards)), header='dashboards', color=Color.BLUE)
+                    showing_tabs = True
+                elif type == Termbox.EVENT_KEY:
+                    current.handle_key(termbox, ch, key)
+                elif type == Termbox.EVENT_MOUSE:
+                    exit(0)
+                event_here = termbox.peek_event()
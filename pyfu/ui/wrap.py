@@ -0,0 +1,67 @@
+"""
+Splits lines of box output into the cells they occupy on screen.
+"""
+
+import unicodedata
+
+TAB_SIZE = 8
+
+
+def char_width(ch):
+    """Columns a character takes on a terminal: 2 for East Asian wide characters, 0 for marks and controls."""
+    if ' ' <= ch < '\x7f':
+        return 1
+    if unicodedata.combining(ch) or unicodedata.category(ch) in ('Cc', 'Cf', 'Mn', 'Me'):
+        return 0
+    if unicodedata.east_asian_width(ch) in ('W', 'F'):
+        return 2
+    return 1
+
+
+def wrap(runs, width, allow_wrap=True):
+    """
+    Returns the rows a line takes in a box width columns wide.
+
+    runs is the line as (text, fg, bg) tuples, see pyfu.ui.ansi.parse.  Each
+    row is (cells, used), where cells is a tuple of (column, (code point, fg,
+    bg)) and used is how many columns the row fills.  Tabs become spaces up
+    to the next tab stop, wide characters take two columns and never straddle
+    two rows, and characters with no width are dropped.  Without allow_wrap
+    the line is cut at the box edge.
+    """
+    width = max(1, width)
+    if len(runs) == 1 and runs[0][0].isascii() and runs[0][0].isprintable():
+        # most command output: one cell per character, no lookups needed.
+        text, fg, bg = runs[0]
+        rows = []
+        for start in range(0, max(1, len(text)), width):
+            segment = text[start:start + width]
+            rows.append((tuple((col, (ord(ch), fg, bg)) for col, ch in enumerate(segment)), len(segment)))
+            if not allow_wrap:
+                break
+        return rows
+    rows = []
+    cells = []
+    col = 0
+    for text, fg, bg in runs:
+        for ch in text:
+            if ch == '\t':
+                # a tab runs to the next tab stop, or to the edge of the box.
+                stop = min(width, (col // TAB_SIZE + 1) * TAB_SIZE)
+                while col < stop:
+                    cells.append((col, (32, fg, bg)))
+                    col += 1
+                continue
+            w = char_width(ch)
+            if w == 0:
+                continue
+            if col + w > width:
+                if not allow_wrap:
+                    return rows + [(tuple(cells), col)]
+                rows.append((tuple(cells), col))
+                cells = []
+                col = 0
+            cells.append((col, (ord(ch), fg, bg)))
+            col += w
+    rows.append((tuple(cells), col))
+    return rows